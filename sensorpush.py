@@ -26,23 +26,44 @@
 # persistantly store temeprature an humidity values in InfluxDB
 #
 
+import re
 import sys
 import json
 import time
-import math
 import requests
 import datetime
 import argparse
 import configparser
+import numpy as np
 from pathlib import Path
 from pprint import pprint
+from concurrent.futures import ThreadPoolExecutor
 from influxdb import InfluxDBClient
 from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
 # __version__ = '1.3.1'
 # __version_info__ = tuple([int(num) for num in __version__.split('.')])
 
+# Use orjson (C extension) for the API (de)serialization if it is
+# available - several times faster than the stdlib, and it works on bytes
+# directly so the utf-8 decode/encode round-trips disappear
+try:
+    import orjson
+
+    def json_dumps(obj):
+        return orjson.dumps(obj)
+
+    def json_loads(data):
+        return orjson.loads(data)
+except ImportError:
+    def json_dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+    def json_loads(data):
+        return json.loads(data)
+
 # Ignore SSL errors and suppress InsecureRequestWarning
 VERIFY_SSL=False
 
@@ -201,7 +222,15 @@ backlogstring = args.backlog
 
 # Convert backlog to minutes
 minutes_per_unit = {"m": 1, "h": 60, "d": 60*24, "w": 60*24*7, "M": 60*24*30.417, "Y": 60*24*365}
-backlog = int(int(backlogstring[:-1]) * minutes_per_unit[backlogstring[-1]])
+# Validate and split amount/unit in one pass - the old string slicing
+# failed with a cryptic KeyError on input like "10min"
+backlogmatch = re.match(r'^(\d+(?:\.\d+)?)([mhdwMY])$', backlogstring)
+if backlogmatch is None:
+    print(f'Invalid backlog "{backlogstring}" - '
+          f'expected <number>[m|h|d|w|M|Y], e.g. 10m, 1.5d or 1M')
+    sys.exit()
+backlog = int(float(backlogmatch.group(1))
+              * minutes_per_unit[backlogmatch.group(2)])
 
 def local_time_offset(t=None):
     """Return offset of local zone from GMT, either at present or at time t."""
@@ -215,40 +244,49 @@ def local_time_offset(t=None):
         return -time.timezone / 3600
 
 
-def F_to_C(F):
-    if noconvert:
-        return float(F)
-    else:
-        C = round((F - 32) * 5.0 / 9.0,2)
-        return float(C)
+def escape_tag_value(value):
+    """Escape the characters line protocol treats specially in tag values."""
+    return value.replace(',', '\\,').replace(' ', '\\ ').replace('=', '\\=')
 
-def ft_to_m(ft):
-    if noconvert:
-        return float(ft)
-    else:
-        m = round(ft * 0.3048,2)
-        return float(m)
 
-def inHg_to_mBar(inHg):
-    if noconvert:
-        return float(inHg)
-    else:
-        mbar = round(inHg * 33.8639,2)
-        return float(mbar)
+# noconvert never changes after argument parsing, so the converters are
+# bound once here instead of re-testing the global on every call
+if noconvert:
+    def F_to_C(F):
+        return F
 
-def kPa_to_mBar(kPa):
-    if noconvert:
-        return float(kPa)
-    else:
-        mBar = round(kPa * 10,2)
-        return float(mBar)
+    def ft_to_m(ft):
+        return ft
+
+    def inHg_to_mBar(inHg):
+        return inHg
+
+    def kPa_to_mBar(kPa):
+        return kPa
+else:
+    def F_to_C(F):
+        return np.round((F - 32) * 5.0 / 9.0, 2)
+
+    def ft_to_m(ft):
+        return np.round(ft * 0.3048, 2)
+
+    def inHg_to_mBar(inHg):
+        return np.round(inHg * 33.8639, 2)
+
+    def kPa_to_mBar(kPa):
+        return np.round(kPa * 10, 2)
 
 # Initiate the InfluxDB client ------------------------------------------------
+# gzip=True compresses the write payloads - line protocol is highly
+# repetitive and shrinks 5-10x, which also saves server-side parse time
 ifdbc = InfluxDBClient(host=IFDB_IP,
                        port=IFDB_PORT,
                        username=IFDB_USER,
                        password=IFDB_PW,
-                       database=IFDB_DB,)
+                       database=IFDB_DB,
+                       gzip=True,
+                       timeout=30,
+                       retries=5)
 
 # Try to get the proper UTC time offseet --------------------------------------
 mytz = datetime.timezone(datetime.timedelta(hours=local_time_offset()))
@@ -268,39 +306,43 @@ else:
 starttimestr = 'Start: ' + datetime.date.strftime(starttime, '%Y-%m-%dT%X%z')
 stoptimestr = 'Stop:  ' + datetime.date.strftime(stoptime, '%Y-%m-%dT%X%z')
 
-timelist = []
-while starttime <= stoptime:
-    start = datetime.date.strftime(starttime, '%Y-%m-%dT%X%z')
-
-    try:
-        nextstop = newstartt + datetime.timedelta(minutes=int(timesteps))
-    except BaseException:
-        nextstop = starttime + datetime.timedelta(minutes=int(timesteps))
-
-    stop = datetime.date.strftime(nextstop, '%Y-%m-%dT%X%z')
-
-    # pprint(start)
-    # pprint(stop)
-
-    currenttime = datetime.datetime.now(tz=mytz)
-    starttime = nextstop - datetime.timedelta(minutes=30)
-    newstartt = nextstop
+# Build the query time slices arithmetically - the old while loop
+# mutated starttime, used a NameError for its first-iteration special
+# case and hid the slice overlap in that state juggling. Each slice
+# still starts 30 minutes before the previous one stopped, but as an
+# explicit parameter (it catches samples right at a slice border).
+step = datetime.timedelta(minutes=timesteps)
+overlap = datetime.timedelta(minutes=30)
 
-    # pprint(starttime)
-    # pprint(stoptime)
+span = stoptime - starttime
+nslices = max(span // step + (1 if span % step else 0), 1)
 
-    timelist.extend([[start, stop]])
+timelist = [
+    [datetime.date.strftime(max(starttime, starttime + i * step - overlap),
+                            '%Y-%m-%dT%X%z'),
+     datetime.date.strftime(starttime + (i + 1) * step, '%Y-%m-%dT%X%z')]
+    for i in range(nslices)
+]
 
-    iterations = len(timelist)
+iterations = len(timelist)
 
 # Set retries for requests ----------------------------------------------------
+# Exponential backoff on server errors instead of 10 back-to-back retries,
+# and a connection pool big enough that keep-alive connections get reused
+# for every API call
+retry = Retry(total=10,
+              backoff_factor=0.5,
+              status_forcelist=[500, 502, 503, 504],
+              allowed_methods=['POST'])
 s = requests.Session()
-s.mount(API_URL_BASE, HTTPAdapter(max_retries=10))
+s.mount(API_URL_BASE, HTTPAdapter(max_retries=retry,
+                                  pool_connections=4,
+                                  pool_maxsize=8))
 
 
 # get API oauth authorization string ------------------------------------------
-pprint('Fetching API oauth authorization string')
-HTTP_DATA = json.dumps({'email': LOGIN, 'password': PASSWD})
+print('Fetching API oauth authorization string')
+HTTP_DATA = json_dumps({'email': LOGIN, 'password': PASSWD})
 
 r = s.post(API_URL_OA_AUTH,
            headers=HTTP_OA_HEAD,
@@ -308,15 +350,17 @@ r = s.post(API_URL_OA_AUTH,
            verify=VERIFY_SSL)
 
 if r.status_code == 200:
-    auth = r.content.decode('utf-8')
+    # The authorization blob goes straight back out in the next request -
+    # keep it as bytes, nothing here needs to decode or parse it
+    auth = r.content
 else:
-    pprint('Auth request failed')
+    print('Auth request failed')
     pprint(r)
     sys.exit()
 
 
 # get API oauth access token --------------------------------------------------
-pprint('Fetching API oauth access token')
+print('Fetching API oauth access token')
 HTTP_DATA = auth
 r = s.post(API_URL_OA_ATOK,
            headers=HTTP_OA_HEAD,
@@ -324,9 +368,9 @@ r = s.post(API_URL_OA_ATOK,
            verify=VERIFY_SSL)
 
 if r.status_code == 200:
-    atok = json.loads(r.content.decode('utf-8'))['accesstoken']
+    atok = json_loads(r.content)['accesstoken']
 else:
-    pprint('Access token request failed')
+    print('Access token request failed')
     pprint(r)
     sys.exit()
 
@@ -335,30 +379,30 @@ HTTP_HEAD = {'accept': 'application/json',
              'Authorization': atok}
 
 # Get a list of gateways ------------------------------------------------------
-pprint('Fetching the list of gateways')
-HTTP_DATA = json.dumps({})
+print('Fetching the list of gateways')
+HTTP_DATA = json_dumps({})
 r = s.post(API_URL_GW,
            headers=HTTP_HEAD,
            data=HTTP_DATA,
            verify=VERIFY_SSL)
 
 if r.status_code == 200:
-    gateways = json.loads(r.content.decode('utf-8'))
+    gateways = json_loads(r.content)
 else:
-    pprint('Could not fetch the list of gateways')
+    print('Could not fetch the list of gateways')
     pprint(r)
     sys.exit()
 
 if listgateways:
-    for id in gateways.keys():
-        # gwname = gateways[id]["name"].encode('utf-8')
-        gwname = gateways[id]["name"]
+    for id, gw in gateways.items():
+        # gwname = gw["name"].encode('utf-8')
+        gwname = gw["name"]
         print(f'---------------{gwname}---------------')
-        print(f'Last alert               : {gateways[id]["last_alert"]}')
-        print(f'Last seen                : {gateways[id]["last_seen"]}')
-        print(f'Message                  : {gateways[id]["message"]}')
-        print(f'Paired                   : {gateways[id]["paired"]}')
-        print(f'Version                  : {gateways[id]["version"]}')
+        print(f'Last alert               : {gw["last_alert"]}')
+        print(f'Last seen                : {gw["last_seen"]}')
+        print(f'Message                  : {gw["message"]}')
+        print(f'Paired                   : {gw["paired"]}')
+        print(f'Version                  : {gw["version"]}')
         print('------------------------------------------------------------')
         print('')
 
@@ -366,17 +410,17 @@ if listgateways:
 
 
 # Get a list of bulk reports --------------------------------------------------
-pprint('Fetching the list of bulk reports')
-HTTP_DATA = json.dumps({})
+print('Fetching the list of bulk reports')
+HTTP_DATA = json_dumps({})
 r = s.post(API_URL_RPL,
            headers=HTTP_HEAD,
            data=HTTP_DATA,
            verify=VERIFY_SSL)
 
 if r.status_code == 200:
-    reports = json.loads(r.content.decode('utf-8'))
+    reports = json_loads(r.content)
 else:
-    pprint('Could not fetch the list of bulk reports')
+    print('Could not fetch the list of bulk reports')
     pprint(r)
     sys.exit()
 
@@ -386,17 +430,17 @@ if len(reports["files"]) > 0:
         pprint(file)
 
 # Get a list of sensors -------------------------------------------------------
-pprint('Fetching the list of sensors')
-HTTP_DATA = json.dumps({})
+print('Fetching the list of sensors')
+HTTP_DATA = json_dumps({})
 r = s.post(API_URL_SE,
            headers=HTTP_HEAD,
            data=HTTP_DATA,
            verify=VERIFY_SSL)
 
 if r.status_code == 200:
-    sensors = json.loads(r.content.decode('utf-8'))
+    sensors = json_loads(r.content)
 else:
-    pprint('Could not fetch the list of sensors')
+    print('Could not fetch the list of sensors')
     pprint(r)
     sys.exit()
 
@@ -430,238 +474,282 @@ for id in sensors.keys():
         print('')
 
     measurement_v.extend([
-        {
-            'measurement': 'SensorPush_V',
-            'tags': {
-                'sensor_id': sensors[id]["id"],
-                'sensor_name': sensors[id]["name"],
-            },
-            'fields': {
-                'voltage': float(BatVolt),
-                'rssi': float(RSSI)
-            },
-            'time': datetime.date.strftime(querytime, '%Y-%m-%dT%X.%z')
-        }
+        f'SensorPush_V,sensor_id={escape_tag_value(sensors[id]["id"])}'
+        f',sensor_name={escape_tag_value(sensors[id]["name"])}'
+        f' voltage={float(BatVolt)},rssi={float(RSSI)}'
+        f' {int(querytime.timestamp())}'
     ])
 
 if listsensors:
     sys.exit(0)
 else:
     if dryrun:
-        pprint(
-            '------------Data that would have been written---------')
-        pprint(measurement_v)
-        pprint(
-            '------------------------------------------------------')
+        print('------------Data that would have been written---------')
+        sys.stdout.write('\n'.join(measurement_v) + '\n')
+        print('------------------------------------------------------')
     else:
-        ifdbc.write_points(measurement_v)
+        ifdbc.write_points(measurement_v,
+                           time_precision='s',
+                           protocol='line')
 # names = [sensors[key]['name'] for key in sensors.keys()]
 
 # Get samples -----------------------------------------------------------------
-pprint('-------------------------------------------------------------------')
-pprint(starttimestr)
-pprint(stoptimestr)
-pprint('-------------------------------------------------------------------')
+print('-------------------------------------------------------------------')
+print(starttimestr)
+print(stoptimestr)
+print('-------------------------------------------------------------------')
 
-pprint('Iterations required: ' + str(iterations))
-pprint('-------------------------------------------------------------------')
+print('Iterations required: ' + str(iterations))
+print('-------------------------------------------------------------------')
 
 iteration = 1
 retrycount = 0
 
 measures = ["altitude","barometric_pressure","dewpoint","humidity","temperature","vpd","distance"]
 
-for item in timelist:
-    failed = True
+# Sensor names do not change between time slices - the escaped tag block
+# of each sensor is built once and reused for every slice
+sensor_tag_blocks = {}
 
-    while failed:
-        try:
-            pprint(f'Iteration {iteration}/{iterations}')
 
-            query = {'startTime': item[0], 'stopTime': item[1], 'measures': measures}
+def fetch_slice(timeslice, wait=0):
+    # Waiting here instead of in the main loop keeps the rate limit
+    # spacing between dispatched queries while the previous response is
+    # being processed and written
+    if wait:
+        time.sleep(wait)
+
+    query = {'startTime': timeslice[0],
+             'stopTime': timeslice[1],
+             'measures': measures}
+
+    if qlimit != 0:
+        query['limit'] = qlimit
+
+    if sensorlist:
+        query['sensors'] = sensorlist
 
-            if qlimit != 0:
-                query['limit'] = qlimit
+    HTTP_DATA = json_dumps(query)
 
-            if sensorlist:
-                query['sensors'] = sensorlist
+    return s.post(API_URL_SPL,
+                  headers=HTTP_HEAD,
+                  data=HTTP_DATA,
+                  verify=VERIFY_SSL)
 
-            HTTP_DATA = json.dumps(query)
 
-            r = s.post(API_URL_SPL,
-                       headers=HTTP_HEAD,
-                       data=HTTP_DATA,
-                       verify=VERIFY_SSL)
+# One background worker fetches the next time slice while the current one
+# is processed - the loop never sits idle in time.sleep between queries
+prefetch = ThreadPoolExecutor(max_workers=1)
+future = prefetch.submit(fetch_slice, timelist[0]) if timelist else None
+
+for idx, item in enumerate(timelist):
+    failed = True
+
+    while failed:
+        try:
+            print(f'Iteration {iteration}/{iterations}')
+
+            r = future.result()
 
             if r.status_code == 200:
-                samples = json.loads(r.content.decode('utf-8'))
+                samples = json_loads(r.content)
                 # pprint(samples)
             else:
                 raise ValueError('Could not fetch samples')
 
+            # The current slice arrived fine - queue the next one (after
+            # the rate limit delay) before crunching this one
+            if idx + 1 < iterations:
+                print(f'Prefetching the next slice in {delay} seconds')
+                future = prefetch.submit(fetch_slice,
+                                         timelist[idx + 1],
+                                         delay)
+
             truncated = samples['truncated']
             numsamples = samples['total_samples']
             numsensosrs = samples['total_sensors']
 
-            pprint('Request truncated: ' + str(truncated))
+            print('Request truncated: ' + str(truncated))
 
             if truncated:
-                pprint('You might want to consider reducing the time slices')
+                print('You might want to consider reducing the time slices')
 
-            pprint('Number of samples fetched: ' + str(numsamples))
-            pprint('Number of sensors queried: ' + str(numsensosrs))
+            print('Number of samples fetched: ' + str(numsamples))
+            print('Number of sensors queried: ' + str(numsensosrs))
 
             # Push data to influxdb -------------------------------------------
             measurement = []
-            for key in samples['sensors'].keys():
-                fields = {}
-                for item in samples['sensors'][key]:
-                    observed = item['observed']
-                    sensor_id = key
-                    sensor_name = sensors[key]['name']
-                    
-                    try:
-                        humidity = float(item['humidity'])
-                    except KeyError as e:
-                        pprint('Humidity not reported by API!')
-                        pprint(f'Setting humidity to None')
-                    else:
-                        fields["humidity"] = humidity
-                    
-                    try:
-                        temperature = F_to_C(item['temperature'])
-                    except Exception as e:
-                        pprint('Temperature not reported by API!')
-                    else:
-                        fields["temperature"] = temperature
-                    
-                    try:
-                        pressure = inHg_to_mBar(item['barometric_pressure'])
-                    except Exception as e:
-                        if dryrun:
-                            pprint('Pressure not reported by API!')
-                            pprint(f'Estimating absolute humidity')
-                        # Absolute humidity (g/m³)
-                        # https://carnotcycle.wordpress.com/2012/08/04/how-to-convert-relative-humidity-to-absolute-humidity/
-                        abs_humidity = float(round((6.112 * math.e**((17.67 * temperature)/(temperature + 243.5)) * humidity * 2.1674) / (273.15 + temperature),2))
-                        fields["abs_humidity"] = abs_humidity
-                    else:
-                        fields["pressure"] = pressure
-                        if dryrun:
-                            pprint(f'Pressure {pressure} reported by API')
-                            pprint('calculating absolute humidity based on reported pressure)')
-                        # Absolute humidity (g/m³)
-                        # https://www.loxwiki.eu/display/LOX/Absolute+Luftfeuchtigkeit+berechnen
-                        abs_humidity = float(round(0.622 * humidity / 100 * (1.01325 * 10.0**(5.426651 - 2005.1 / (temperature + 273.15) + 0.00013869 * ((temperature + 273.15) * (temperature + 273.15) - 293700.0) / (temperature + 273.15) * (10.0**(0.000000000011965 * ((temperature + 273.15) * (temperature + 273.15) - 293700.0) * ((temperature + 273.15) * (temperature + 273.15) - 293700.0)) - 1.0) - 0.0044 * 10.0**((-0.0057148 * (374.11 - temperature)**1.25))) + (((temperature + 273.15) / 647.3) - 0.422) * (0.577 - ((temperature + 273.15) / 647.3)) * math.exp(0.000000000011965 * ((temperature + 273.15) * (temperature + 273.15) - 293700.0) * ((temperature + 273.15) * (temperature + 273.15) - 293700.0)) * 0.00980665) / (pressure / 1000.0 - humidity / 100.0 * (1.01325 * 10.0**(5.426651 - 2005.1 / (temperature + 273.15) + 0.00013869 * ((temperature + 273.15) * (temperature + 273.15) - 293700.0) / (temperature + 273.15) * (10.0**(0.000000000011965 * ((temperature + 273.15) * (temperature + 273.15) - 293700.0) * ((temperature + 273.15) * (temperature + 273.15) - 293700.0)) - 1.0) - 0.0044 * 10.0**((-0.0057148 * (374.11 - temperature)**1.25))) + (((temperature + 273.15) / 647.3) - 0.422) * (0.577 - ((temperature + 273.15) / 647.3)) * math.exp(0.000000000011965 * ((temperature + 273.15) * (temperature + 273.15) - 293700.0) * ((temperature + 273.15) * (temperature + 273.15) - 293700.0)) * 0.00980665)) * pressure/1000.0 * 100000000.0 / ((temperature + 273.15) * 287.1),2))
-                        fields["abs_humidity"] = abs_humidity
-
-                    try:
-                        alti = float(item['altitude'])
-                    except Exception as e:
-                        if dryrun:
-                            pprint(f'No altitude provided by API!)')
-                            pprint(f'Setting altitude to custom altitude {MY_ALTITUDE} from config file')
-                        fields["altitude"] = float(MY_ALTITUDE)
-                    else:
-                        if dryrun:
-                            pprint(f'Altitude {alti} provided by API')
-                        if alti == 0:
-                            pprint(f'Altitude reported via API == {alti}')
-                            pprint(f'Setting altitude to custom altitude {MY_ALTITUDE} from config file')
-                            fields["altitude"] = float(MY_ALTITUDE)
-                        else:
-                            try:
-                                fields["altitude"] = ft_to_m(alti)
-                            except Exception as e:
-                                if dryrun:
-                                    pprint(f'Altitude {alti} failed to be processed! - Ignoring altitude field!')
-                                pass
-
-                    try:
-                        fields["distance"] = ft_to_m(item['distance'])
-                    except KeyError as e:
-                        if dryrun:
-                            pprint('Distance not reported by API!')
-                    else:
-                        fields["distance"] = distance
-
-                    try:
-                        fields["dewpoint"] = F_to_C(item['dewpoint'])
-                    except KeyError as e:
-                        if dryrun:
-                            pprint('Dewpoint not reported by API!')
-                            pprint('Calculating dewpoint!')
-                        # Dewpoint in degree centigrate
-                        # https://cals.arizona.edu/azmet/dewpoint.html
-                        fields["dewpoint"] = float(round((237.3 * ((math.log(humidity / 100) + ((17.27 * temperature) / (237.3 + temperature))) / 17.27)) / (1 - ((math.log(humidity / 100) + ((17.27 * temperature) / (237.3 + temperature))) / 17.27)),2))
-                        
-                        
-                    try:
-                        fields["vpd"] = kPa_to_mBar(item['vpd'])
-                    except Exception as e:
-                        if dryrun:
-                            pprint('VPD not reported by API!')
-                            pprint('Calculating VPD!')
-                        # Vapor Pressure Deficit in mBar
-                        # https://pulsegrow.com/blogs/learn/vpd
-                        fields["vpd"] = float(kPa_to_mBar(((610.78 * math.e**(temperature / (temperature + 238.3) * 17.2694)) / 1000) * (1 - humidity/100)))
-
-                    
-                    data = {
-                            'measurement': 'SensorPush',
-                            'tags': {
-                                'sensor_id': key,
-                                'sensor_name': sensors[key]['name'],
-                            },
-                            'fields': fields,
-                            'time': observed
-                        }
-                    
-                    measurement.extend([data])
+            for key, items in samples['sensors'].items():
+                if not items:
+                    continue
+
+                sensor_name = sensors[key]['name']
+
+                # Gather the samples into NumPy columns once - the derived
+                # physics below then runs as vectorized array math at C
+                # speed instead of re-evaluating the formulas per sample in
+                # Python. Measures the API did not report become NaN and
+                # are filled in (or left out) below.
+                nan = float('nan')
+                humidity = np.asarray(
+                    [sample.get('humidity', nan) for sample in items],
+                    dtype=np.float64)
+                temperature = F_to_C(np.asarray(
+                    [sample.get('temperature', nan) for sample in items],
+                    dtype=np.float64))
+                pressure = inHg_to_mBar(np.asarray(
+                    [sample.get('barometric_pressure', nan) for sample in items],
+                    dtype=np.float64))
+                altitude = ft_to_m(np.asarray(
+                    [sample.get('altitude', nan) for sample in items],
+                    dtype=np.float64))
+                distance = ft_to_m(np.asarray(
+                    [sample.get('distance', nan) for sample in items],
+                    dtype=np.float64))
+                dewpoint = F_to_C(np.asarray(
+                    [sample.get('dewpoint', nan) for sample in items],
+                    dtype=np.float64))
+                vpd = kPa_to_mBar(np.asarray(
+                    [sample.get('vpd', nan) for sample in items],
+                    dtype=np.float64))
+
+                has_pressure = pressure == pressure
+
+                # NaN inputs propagate to NaN outputs, which is what we
+                # want - silence the warnings NumPy would emit for them
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    # The formulas below evaluated T + 273.15 over a dozen
+                    # times and the saturation vapour pressure twice -
+                    # factor the shared pieces out once, and compute
+                    # 10**x as exp(x * ln 10) (exp is the cheaper
+                    # transcendental)
+                    LN10 = 2.302585092994046
+                    TK = temperature + 273.15
+                    T2m = TK * TK - 293700.0
+                    rel_hum = humidity / 100.0
+                    x_T2m2 = 0.000000000011965 * T2m * T2m
+
+                    # Absolute humidity (g/m³) - without reported pressure
+                    # https://carnotcycle.wordpress.com/2012/08/04/how-to-convert-relative-humidity-to-absolute-humidity/
+                    abs_humidity_est = np.round((6.112 * np.exp((17.67 * temperature)/(temperature + 243.5)) * humidity * 2.1674) / TK, 2)
+
+                    # Absolute humidity (g/m³) - based on reported pressure
+                    # https://www.loxwiki.eu/display/LOX/Absolute+Luftfeuchtigkeit+berechnen
+                    # Saturation vapour pressure - shared by the numerator
+                    # and the denominator below
+                    svp = (1.01325 * np.exp(LN10 * (5.426651 - 2005.1 / TK
+                           + 0.00013869 * T2m / TK * (np.exp(LN10 * x_T2m2) - 1.0)
+                           - 0.0044 * np.exp(LN10 * (-0.0057148 * (374.11 - temperature)**1.25))))
+                           + ((TK / 647.3) - 0.422) * (0.577 - (TK / 647.3))
+                           * np.exp(x_T2m2) * 0.00980665)
+
+                    abs_humidity_prs = np.round(
+                        0.622 * rel_hum * svp
+                        / (pressure / 1000.0 - rel_hum * svp)
+                        * pressure / 1000.0 * 100000000.0 / (TK * 287.1), 2)
+
+                    abs_humidity = np.where(has_pressure,
+                                            abs_humidity_prs,
+                                            abs_humidity_est)
+
+                    # Dewpoint in degree centigrade - where not reported
+                    # https://cals.arizona.edu/azmet/dewpoint.html
+                    gamma = (np.log(rel_hum)
+                             + ((17.27 * temperature) / (237.3 + temperature))) / 17.27
+                    dewpoint_calc = np.round(237.3 * gamma / (1 - gamma), 2)
+                    dewpoint = np.where(dewpoint == dewpoint,
+                                        dewpoint,
+                                        dewpoint_calc)
+
+                    # Vapor Pressure Deficit in mBar - where not reported
+                    # https://pulsegrow.com/blogs/learn/vpd
+                    vpd_calc = kPa_to_mBar(((610.78 * np.exp(temperature / (temperature + 238.3) * 17.2694)) / 1000) * (1 - humidity/100))
+                    vpd = np.where(vpd == vpd, vpd, vpd_calc)
+
+                    # Missing altitude (and the API's bogus 0) falls back to
+                    # the configured altitude
+                    altitude = np.where((altitude != altitude) | (altitude == 0),
+                                        MY_ALTITUDE,
+                                        altitude)
+
+                # 'observed' is second-resolution RFC3339 in UTC - one
+                # vectorized pass turns it into the epoch timestamps the
+                # line protocol wants (time_precision='s')
+                ts_s = np.array([sample['observed'][:19] for sample in items],
+                                dtype='datetime64[s]').astype(np.int64)
+
+                tag_block = sensor_tag_blocks.get(key)
+                if tag_block is None:
+                    tag_block = (f'SensorPush,sensor_id={key}'
+                                 f',sensor_name={escape_tag_value(sensor_name)}')
+                    sensor_tag_blocks[key] = tag_block
+
+                for i in range(len(items)):
+                    # NaN != NaN - a value is only written if it was either
+                    # reported by the API or derivable from what was
+                    field_tokens = []
+                    if humidity[i] == humidity[i]:
+                        field_tokens.append(f'humidity={humidity[i]}')
+                    if temperature[i] == temperature[i]:
+                        field_tokens.append(f'temperature={temperature[i]}')
+                    if has_pressure[i]:
+                        field_tokens.append(f'pressure={pressure[i]}')
+                    if abs_humidity[i] == abs_humidity[i]:
+                        field_tokens.append(f'abs_humidity={abs_humidity[i]}')
+                    field_tokens.append(f'altitude={altitude[i]}')
+                    if distance[i] == distance[i]:
+                        field_tokens.append(f'distance={distance[i]}')
+                    if dewpoint[i] == dewpoint[i]:
+                        field_tokens.append(f'dewpoint={dewpoint[i]}')
+                    if vpd[i] == vpd[i]:
+                        field_tokens.append(f'vpd={vpd[i]}')
+
+                    measurement.append(
+                        f'{tag_block} {",".join(field_tokens)} {ts_s[i]}')
 
             if dryrun:
-                pprint(
-                    '------------Data that would have been written---------')
-                pprint(measurement)
-                pprint(
-                    '------------------------------------------------------')
+                # The lines are plain strings - one joined write instead
+                # of pprint reflecting over a 10k-element list
+                print('------------Data that would have been written---------')
+                sys.stdout.write('\n'.join(measurement) + '\n')
+                print('------------------------------------------------------')
             else:
-                ifdbc.write_points(measurement)
+                # Batches of 5-10k points are the InfluxDB ingest sweet
+                # spot - let the client chunk the list accordingly
+                ifdbc.write_points(measurement,
+                                   batch_size=5000,
+                                   time_precision='s',
+                                   protocol='line')
 
             iteration += 1
 
-            if iterations > 1:
-                pprint(
-                    '------------------------------------------------------')
-                pprint(f'sleeping for {delay} seconds')
-                pprint(
-                    '------------------------------------------------------')
-
-                time.sleep(delay)
-
         except Exception as e:
             retrycount += 1
-            pprint('')
-            pprint('##################Somthing went wrong################')
-            pprint('~~~~~~~~~~~~Exception~~~~~~~~~~~~~')
+            print('')
+            print('##################Somthing went wrong################')
+            print('~~~~~~~~~~~~Exception~~~~~~~~~~~~~')
             pprint(e)
-            pprint('~~~~~~~~~~~~Request status code~~~~~~~~~~~~~')
+            print('~~~~~~~~~~~~Request status code~~~~~~~~~~~~~')
             pprint(r.status_code)
-            pprint('~~~~~~~~~~~~~~~~~~~~~~~~~')
+            print('~~~~~~~~~~~~~~~~~~~~~~~~~')
             pprint(r.headers)
-            pprint('~~~~~~~~~~~~Request content~~~~~~~~~~~~~')
+            print('~~~~~~~~~~~~Request content~~~~~~~~~~~~~')
             pprint(r.content.decode('utf-8'))
             pprint(
                 '------------------------------------------------------')
-            pprint(f'Retrying iteration {iteration}/{iterations}')
-            pprint(f'Try {retrycount}/{MAXRETRY}')
-            pprint(f'sleeping for {RETRYWAIT} seconds before next try')
-            pprint('######################################################')
-            pprint('')
+            print(f'Retrying iteration {iteration}/{iterations}')
+            print(f'Try {retrycount}/{MAXRETRY}')
+            print(f'sleeping for {RETRYWAIT} seconds before next try')
+            print('######################################################')
+            print('')
             if retrycount >= MAXRETRY:
-                pprint('Reached max retries ({MAXRETRY}) Stopping now!')
+                print('Reached max retries ({MAXRETRY}) Stopping now!')
                 sys.exit()
             time.sleep(RETRYWAIT)
+            # Fetch the failed slice again (this drops an already queued
+            # prefetch of the next slice, which simply gets re-queued
+            # once this one succeeds)
+            future = prefetch.submit(fetch_slice, item)
             continue
         else:
             failed = False
@@ -29,17 +29,14 @@
 import sys
 import uuid
 import os
-import csv
 import json
 import time
 import datetime
 import argparse
 import configparser
-import math
-from pprint import pprint
+import pandas as pd
 from influxdb import InfluxDBClient
 from pathlib import Path
-from itertools import zip_longest
 
 
 # __version__ = '1.1.1'
@@ -128,11 +125,6 @@ if not sensorid:
     #sensorid = sensorname
 
 
-def grouper(iterable, n, fillvalue=None):
-    args = [iter(iterable)] * n
-    return zip_longest(*args, fillvalue=fillvalue)
-
-
 def local_time_offset(t=None):
     """Return offset of local zone from GMT, either at present or at time t."""
     # python2.3 localtime() can't take None
@@ -145,72 +137,63 @@ def local_time_offset(t=None):
         return -time.timezone / 3600
 
 
+# gzip=True compresses the write payloads - line protocol is highly
+# repetitive and shrinks 5-10x, which also saves server-side parse time
 ifdbc = InfluxDBClient(host=IFDB_IP,
                        port=IFDB_PORT,
                        username=IFDB_USER,
                        password=IFDB_PW,
-                       database=IFDB_DB)
+                       database=IFDB_DB,
+                       gzip=True)
 
 
 # Try to get the proper UTC time offseet --------------------------------------
 mytz = datetime.timezone(datetime.timedelta(hours=local_time_offset()))
 currenttime = datetime.datetime.now(tz=mytz)
 
-measurement = []
-
-with open(csvfile) as csv_file:
-    csv_reader = csv.reader(csv_file, delimiter=',')
-    line_count = 0
-    for row in csv_reader:
-        if line_count == 0:
-            print(f'Column headers are {", ".join(row)}')
-            timeshead, temphead, humihead = row
-            line_count += 1
-        else:
-            dtime = datetime.datetime.strptime(
-                row[0],
-                '%Y-%m-%d %H:%M').isoformat()
-            celsius = float(row[1].replace(',', '.'))
-            hum = float(row[2].replace(',', '.'))
-            measurement.extend([
-                {
-                               'measurement': 'SensorPush',
-                               'tags': {
-                                   'sensor_id': sensorid,
-                                   'sensor_name': sensorname,
-                               },
-                               'fields': {
-                                   'temperature': celsius,
-                                   'humidity': hum,
-                               },
-                               # 'observed': '2019-07-26T15:09:18.000Z
-                               'time': dtime
-                               }
-            ])
-            line_count += 1
-
-# pprint(measurement)
-numsamples = len(measurement)
-pprint(f'Samples: {numsamples}')
-
-iterations = math.ceil(numsamples / chunks)
-
-g = grouper(measurement, chunks)
-
-i = 1
-for item in g:
-    pprint(f'Writing batch {i}/{iterations} to influxdb')
-    # Since grouper fills a group with None, we have to get rid of those
-    # before writing it to InfluxDB
-    b = [j for j in item if j]
-    if len(b):
-        if dryrun:
-            pprint(b)
-            pprint('--------------------')
-            pprint('')
-        else:
-            ifdbc.write_points(b)
-    else:
-        pprint('Nothing to write for this chunk')
+def escape_tag_value(value):
+    """Escape the characters line protocol treats specially in tag values."""
+    return value.replace(',', '\\,').replace(' ', '\\ ').replace('=', '\\=')
+
+
+# Build line protocol directly - the tag block is constant, so each line
+# is just the two field values and the epoch timestamp appended to it
+tag_block = (f'SensorPush,sensor_id={escape_tag_value(sensorid)}'
+             f',sensor_name={escape_tag_value(sensorname)}')
+
+numsamples = 0
 
-    i += 1
+# pandas' C parser tokenizes the file chunk by chunk (decimal=','
+# handles the App's comma decimals) instead of a Python loop with
+# strptime/replace/float per row - and each chunk is written before the
+# next one is parsed, so a multi-year export never sits in RAM whole
+for df in pd.read_csv(csvfile, decimal=',', chunksize=chunks):
+    if numsamples == 0:
+        print(f'Column headers are {", ".join(df.columns)}')
+
+    # The export has a fixed 'YYYY-MM-DD HH:MM' timestamp layout
+    epoch_s = pd.to_datetime(
+        df.iloc[:, 0],
+        format='%Y-%m-%d %H:%M').values.view('int64') // 1_000_000_000
+
+    measurement = (tag_block
+                   + ' temperature=' + df.iloc[:, 1].astype(str)
+                   + ',humidity=' + df.iloc[:, 2].astype(str)
+                   + ' ' + pd.Series(epoch_s, index=df.index).astype(str)
+                   ).tolist()
+
+    numsamples += len(measurement)
+
+    if dryrun:
+        # Plain joined write - pprint would reflect over every element
+        sys.stdout.write('\n'.join(measurement) + '\n')
+    else:
+        # The lines are already finished line protocol, so they go to
+        # the raw write endpoint as-is - write_points would only
+        # re-validate and re-join every batch
+        ifdbc.write(measurement,
+                    params={'db': IFDB_DB, 'precision': 's'},
+                    expected_response_code=204,
+                    protocol='line')
+
+print(f'Samples written: {numsamples}')
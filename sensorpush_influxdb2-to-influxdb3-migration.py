@@ -0,0 +1,641 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# -----------------------------------------------------------------------------
+# sensorpush_influxdb2-to-influxdb3-migration.py, Copyright Bjoern Olausson
+# -----------------------------------------------------------------------------
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# To view the license visit
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.html
+# or write to
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+#
+# This Python 3 program migrates the SensorPush measurements collected by
+# sensorpush2.py from InfluxDB 2.x to InfluxDB 3
+#
+
+import os
+import sys
+import gzip
+import json
+import time
+import queue
+import signal
+import datetime
+import argparse
+import threading
+import configparser
+import httpx
+import numpy as np
+from pathlib import Path
+from pprint import pprint
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from influxdb_client import InfluxDBClient
+
+# Use orjson (C extension) for the JSON work if it is available, fall back
+# to the stdlib otherwise
+try:
+    import orjson
+
+    def json_loads(data):
+        return orjson.loads(data)
+
+    def json_dumps(obj):
+        return orjson.dumps(obj).decode('utf-8')
+except ImportError:
+    def json_loads(data):
+        return json.loads(data)
+
+    def json_dumps(obj):
+        return json.dumps(obj)
+
+homedir = str(Path.home())
+
+CONFIGFILE = f'{homedir}/.sensorpush-migration.conf'
+
+# Retries for failed InfluxDB 3 writes, with exponential backoff
+WRITE_MAXRETRY = 5
+
+config = configparser.ConfigParser()
+
+if not Path(CONFIGFILE).is_file():
+    config['INFLUXDB2CONF'] = {
+        'MEASUREMENT_NAME': 'SensorPush',
+        'IFDB2_URL': 'InfluxDB 2.x URL',
+        'IFDB2_PORT': 'InfluxDB 2.x port',
+        'IFDB2_VERIFY_SSL': 'InfluxDB 2.x skip verifying SSL certificate',
+        'IFDB2_TOKEN': 'InfluxDB 2.x token',
+        'IFDB2_ORG': 'InfluxDB 2.x Org',
+        'IFDB2_BUCKET': 'InfluxDB 2.x bucket'
+    }
+    config['INFLUXDB3CONF'] = {
+        'IFDB3_MEASUREMENT_NAME': 'SensorPush',
+        'IFDB3_URL': 'InfluxDB 3 URL',
+        'IFDB3_TOKEN': 'InfluxDB 3 token',
+        'IFDB3_DATABASE': 'InfluxDB 3 database'
+    }
+    with open(CONFIGFILE, 'w') as f:
+        config.write(f)
+
+    print(f'Wrote a configuration template to {CONFIGFILE}')
+    print('Please fill in your values and run again')
+    sys.exit(0)
+else:
+    config.read(CONFIGFILE)
+
+MEASUREMENT_NAME = config['INFLUXDB2CONF']['MEASUREMENT_NAME']
+IFDB2_URL = config['INFLUXDB2CONF']['IFDB2_URL']
+IFDB2_PORT = int(config['INFLUXDB2CONF']['IFDB2_PORT'])
+IFDB2_VERIFY_SSL = config['INFLUXDB2CONF'].getboolean('IFDB2_VERIFY_SSL')
+IFDB2_TOKEN = config['INFLUXDB2CONF']['IFDB2_TOKEN']
+IFDB2_ORG = config['INFLUXDB2CONF']['IFDB2_ORG']
+IFDB2_BUCKET = config['INFLUXDB2CONF']['IFDB2_BUCKET']
+
+IFDB3_MEASUREMENT_NAME = config['INFLUXDB3CONF']['IFDB3_MEASUREMENT_NAME']
+IFDB3_URL = config['INFLUXDB3CONF']['IFDB3_URL']
+IFDB3_TOKEN = config['INFLUXDB3CONF']['IFDB3_TOKEN']
+IFDB3_DATABASE = config['INFLUXDB3CONF']['IFDB3_DATABASE']
+
+# Source measurement -> target measurement, resolved once instead of
+# checking for the _V suffix on every record
+MEAS_MAP = {MEASUREMENT_NAME: IFDB3_MEASUREMENT_NAME,
+            f'{MEASUREMENT_NAME}_V': f'{IFDB3_MEASUREMENT_NAME}_V'}
+
+parser = argparse.ArgumentParser(
+    description='Migrates the SensorPush measurements written by sensorpush2.py\
+                from InfluxDB 2.x to InfluxDB 3')
+parser.add_argument(
+    '-s',
+    '--start',
+    dest='starttime',
+    default='',
+    type=str,
+    help='Migrate data starting at time (e.g. "2019-07-25T00:10:41+0200")')
+parser.add_argument(
+    '-p',
+    '--stop',
+    dest='stoptime',
+    default='',
+    type=str,
+    help='Migrate data up to time (e.g. "2019-07-26T00:10:41+0200")')
+parser.add_argument(
+    '-a',
+    '--all',
+    dest='migrate_all',
+    action='store_true',
+    help='Migrate everything from the earliest datapoint found in InfluxDB 2.x')
+parser.add_argument(
+    '-c',
+    '--chunkdays',
+    dest='chunkdays',
+    default='7',
+    type=int,
+    help='Time chunk per query (in days) to migrate (default 7 days)')
+parser.add_argument(
+    '-b',
+    '--batchsize',
+    dest='batch_size',
+    default='5000',
+    type=int,
+    help='Number of records to accumulate before writing them to InfluxDB 3')
+parser.add_argument(
+    '-f',
+    '--progressfile',
+    dest='progress_file',
+    default=f'{homedir}/.sensorpush-migration-progress.json',
+    type=str,
+    help='File to persist the migration progress to for resuming')
+parser.add_argument(
+    '-w',
+    '--workers',
+    dest='workers',
+    default='1',
+    type=int,
+    help='Number of worker processes to migrate chunks in parallel\
+         (default 1 = serial)')
+parser.add_argument(
+    '-x',
+    '--dryrun',
+    dest='dryrun',
+    action='store_true',
+    help='Do not write anything to InfluxDB 3,\
+        just print a sample of what would have been written')
+
+args = parser.parse_args()
+
+dryrun = args.dryrun
+
+# Columns returned by the Flux pivot which are not actual sensor fields
+excluded_keys = ('result', 'table', '_start', '_stop', '_time', '_measurement',
+                 'sensor_id', 'sensor_name')
+
+
+def handle_signal(signum, frame):
+    pprint(f'Received signal {signum} - stopping after current chunk')
+    global stop_requested
+    stop_requested = True
+
+
+stop_requested = False
+signal.signal(signal.SIGINT, handle_signal)
+signal.signal(signal.SIGTERM, handle_signal)
+
+
+def load_progress():
+    # The progress file is append-only NDJSON - the last non-empty line is
+    # the current resume point
+    pf = Path(args.progress_file)
+    if pf.is_file():
+        lines = [line for line in pf.read_text().splitlines() if line.strip()]
+        if lines:
+            return json_loads(lines[-1])
+    return {}
+
+
+def save_progress(progress):
+    # Append one line per completed chunk instead of rewriting the whole
+    # document - O(1) per chunk and crash-safe thanks to the fsync
+    with open(args.progress_file, 'a') as f:
+        f.write(json_dumps(progress) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def build_flux_query(chunk_start_str, chunk_end_str):
+    flux_query = f'''
+from(bucket: "{IFDB2_BUCKET}")
+  |> range(start: {chunk_start_str}, stop: {chunk_end_str})
+  |> filter(fn: (r) => r._measurement == "{MEASUREMENT_NAME}" or r._measurement == "{MEASUREMENT_NAME}_V")
+  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+  |> drop(columns: ["_start", "_stop", "result", "table"])
+'''
+    return flux_query
+
+
+# Translation table for the characters with special meaning in line
+# protocol tags, compiled once at import
+TAG_ESCAPE_TABLE = str.maketrans({'\\': '\\\\', ',': '\\,', '=': '\\=', ' ': '\\ '})
+
+
+@lru_cache(maxsize=1024)
+def escape_tag_value(value):
+    # There are only a handful of distinct sensor ids/names but millions of
+    # records, so the cache turns escaping into a single dict lookup
+    return value.translate(TAG_ESCAPE_TABLE)
+
+
+def format_lp(measurement, tag_tokens, field_tokens, ts_ns):
+    return f'{measurement}{tag_tokens} {",".join(field_tokens)} {ts_ns}'
+
+
+def iter_row_batches(row_iter):
+    # Group the annotated CSV stream into (header, rows) batches, skipping
+    # annotation and table-separator rows. The header changes at table
+    # boundaries, so a batch never spans two tables.
+    header = None
+    batch = []
+    for row in row_iter:
+        if not row:
+            continue
+        if row[0].startswith('#'):
+            if batch:
+                yield header, batch
+                batch = []
+            header = None
+            continue
+        if header is None:
+            header = row
+            continue
+        batch.append(row)
+        if len(batch) >= args.batch_size:
+            yield header, batch
+            batch = []
+    if batch:
+        yield header, batch
+
+
+def flush_columns(times, measurements, sensor_ids, sensor_names, cols, colcount):
+    # Convert the accumulated per-field columns en masse with NumPy instead of
+    # calling float() per record - the cast runs as one C-level loop per field
+    converted = {}
+    for field_name, values in cols.items():
+        converted[field_name] = np.asarray(
+            [v if v else 'nan' for v in values],
+            dtype=np.float64)
+
+    # Parse the RFC3339 timestamps to integer nanoseconds in one vectorized
+    # pass - Flux always returns UTC, so the trailing Z can simply be dropped
+    times_ns = np.array([t[:-1] if t.endswith('Z') else t for t in times],
+                        dtype='datetime64[ns]').astype(np.int64)
+
+    batch = []
+    for i in range(colcount):
+        target_measurement = MEAS_MAP.get(measurements[i], IFDB3_MEASUREMENT_NAME)
+
+        tag_tokens = ''
+        if sensor_ids[i]:
+            tag_tokens += f',sensor_id={escape_tag_value(sensor_ids[i])}'
+        if sensor_names[i]:
+            tag_tokens += f',sensor_name={escape_tag_value(sensor_names[i])}'
+
+        field_tokens = []
+        for field_name, arr in converted.items():
+            value = arr[i]
+            # NaN never equals itself - cheapest possible missing-value check
+            if value == value:
+                field_tokens.append(f'{field_name}={value}')
+
+        if not field_tokens:
+            continue
+
+        # Emit line protocol directly - this skips the dict construction here
+        # and the dict-to-line-protocol conversion inside the client
+        batch.append(format_lp(target_measurement, tag_tokens, field_tokens,
+                               times_ns[i]))
+
+    return batch
+
+
+def make_write_client():
+    # One persistent HTTP/2 connection for all InfluxDB 3 writes - avoids
+    # the per-batch connection setup of the client library write path
+    return httpx.Client(http2=True,
+                        headers={'Authorization': f'Bearer {IFDB3_TOKEN}',
+                                 'Content-Encoding': 'gzip'},
+                        timeout=60)
+
+
+def write_lp(client, lp_batch):
+    # gzip shrinks the line protocol payload considerably before it goes
+    # over the wire
+    payload = gzip.compress('\n'.join(lp_batch).encode('utf-8'))
+
+    retrywait = 1
+    for attempt in range(1, WRITE_MAXRETRY + 1):
+        try:
+            r = client.post(f'{IFDB3_URL}/api/v3/write_lp',
+                            params={'db': IFDB3_DATABASE,
+                                    'precision': 'nanosecond'},
+                            content=payload)
+        except httpx.HTTPError as e:
+            pprint(f'Write failed ({e}) - try {attempt}/{WRITE_MAXRETRY}')
+        else:
+            if r.status_code in (200, 204):
+                return
+            pprint(f'Write failed with status {r.status_code} - try {attempt}/{WRITE_MAXRETRY}')
+            pprint(r.content.decode('utf-8'))
+
+        time.sleep(retrywait)
+        retrywait *= 2
+
+    pprint(f'Reached max retries ({WRITE_MAXRETRY}) Stopping now!')
+    sys.exit()
+
+
+def process_rows(header, rows, writer):
+    # Transform one batch of raw CSV rows. Working on plain row tuples from
+    # the C-level CSV parser avoids the per-record FluxRecord object and
+    # values-dict construction of query_stream().
+    time_idx = header.index('_time')
+    meas_idx = header.index('_measurement')
+
+    try:
+        sid_idx = header.index('sensor_id')
+    except ValueError:
+        sid_idx = None
+
+    try:
+        sname_idx = header.index('sensor_name')
+    except ValueError:
+        sname_idx = None
+
+    field_cols = [(i, name) for i, name in enumerate(header)
+                  if name and name not in excluded_keys]
+
+    # Accumulate the rows into columnar buffers (one list per field name)
+    # so the float coercion can be vectorized per batch
+    times = []
+    measurements = []
+    sensor_ids = []
+    sensor_names = []
+    cols = {name: [] for i, name in field_cols}
+
+    for row in rows:
+        times.append(row[time_idx])
+        measurements.append(row[meas_idx])
+        sensor_ids.append(row[sid_idx] if sid_idx is not None else '')
+        sensor_names.append(row[sname_idx] if sname_idx is not None else '')
+
+        for i, name in field_cols:
+            cols[name].append(row[i])
+
+    batch = flush_columns(times, measurements, sensor_ids, sensor_names,
+                          cols, len(times))
+
+    if batch:
+        if dryrun:
+            pprint('------------Sample of data that would have been written---------')
+            pprint(batch[0])
+            pprint(f'... plus {len(batch) - 1} more lines')
+            pprint('----------------------------------------------------------------')
+        else:
+            write_lp(writer, batch)
+
+    return len(rows), len(batch)
+
+
+def migrate_chunk(chunk_start_str, chunk_end_str):
+    # Runs in a worker process - each worker opens its own clients since
+    # HTTP connections do not survive a fork. Signal handling stays in the
+    # parent; the workers are terminated by the executor on shutdown.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    w_ifdbc2 = InfluxDBClient(url=f'{IFDB2_URL}:{IFDB2_PORT}',
+                              token=IFDB2_TOKEN,
+                              org=IFDB2_ORG,
+                              verify_ssl=IFDB2_VERIFY_SSL,
+                              timeout=300_000)
+
+    w_writer = make_write_client()
+
+    flux_query = build_flux_query(chunk_start_str, chunk_end_str)
+
+    records_read = 0
+    records_written = 0
+    rows_iter = w_ifdbc2.query_api().query_csv(flux_query)
+    for header, rows in iter_row_batches(rows_iter):
+        batch_read, batch_written = process_rows(header, rows, w_writer)
+        records_read += batch_read
+        records_written += batch_written
+
+    w_writer.close()
+    w_ifdbc2.close()
+
+    return records_read, records_written
+
+
+# Initiate the InfluxDB clients -----------------------------------------------
+ifdbc2 = InfluxDBClient(url=f'{IFDB2_URL}:{IFDB2_PORT}',
+                        token=IFDB2_TOKEN,
+                        org=IFDB2_ORG,
+                        verify_ssl=IFDB2_VERIFY_SSL,
+                        timeout=300_000)
+ifdbc2_query = ifdbc2.query_api()
+
+ifdbc3 = make_write_client()
+
+# Figure out the time range to migrate ----------------------------------------
+currenttime = datetime.datetime.now(datetime.timezone.utc)
+
+if args.migrate_all:
+    # Ask for the earliest datapoint of the measurement through the Flux
+    # client that is already open - its pooled HTTP connection gets reused
+    # and InfluxDB can answer this with an index-only query
+    pprint('Fetching the earliest datapoint from InfluxDB 2.x')
+    first_flux = f'''
+from(bucket: "{IFDB2_BUCKET}")
+  |> range(start: 0)
+  |> filter(fn: (r) => r._measurement == "{MEASUREMENT_NAME}")
+  |> first()
+  |> keep(columns: ["_time"])
+'''
+
+    tables = ifdbc2_query.query(first_flux)
+
+    firsttimes = [record.get_time() for table in tables for record in table.records]
+
+    if not firsttimes:
+        pprint(f'No data found in InfluxDB 2.x for measurement {MEASUREMENT_NAME}')
+        sys.exit()
+
+    starttime = min(firsttimes)
+elif args.starttime:
+    starttime = datetime.datetime.strptime(args.starttime, '%Y-%m-%dT%X%z')
+else:
+    print('You must specify either --start or --all')
+    sys.exit(0)
+
+if args.stoptime:
+    stoptime = datetime.datetime.strptime(args.stoptime, '%Y-%m-%dT%X%z')
+else:
+    stoptime = currenttime
+
+progress = load_progress()
+
+if progress.get('last_completed'):
+    resumetime = datetime.datetime.fromisoformat(progress['last_completed'])
+    if resumetime > starttime:
+        pprint(f'Resuming from {progress["last_completed"]}')
+        starttime = resumetime
+
+def utc_str(ts):
+    """Render a chunk boundary as the UTC instant Flux range() expects."""
+    # strftime alone would print the local wall-clock time with a
+    # literal Z, shifting the window for offset-aware --start/--stop
+    return datetime.date.strftime(ts.astimezone(datetime.timezone.utc),
+                                  '%Y-%m-%dT%H:%M:%SZ')
+
+
+# Build the list of time chunks to migrate ------------------------------------
+chunklist = []
+chunk_start = starttime
+while chunk_start < stoptime:
+    chunk_end = min(chunk_start + datetime.timedelta(days=args.chunkdays), stoptime)
+    chunklist.append([chunk_start, chunk_end])
+    chunk_start = chunk_end
+
+iterations = len(chunklist)
+
+pprint('-------------------------------------------------------------------')
+pprint('Start: ' + datetime.date.strftime(starttime, '%Y-%m-%dT%X%z'))
+pprint('Stop:  ' + datetime.date.strftime(stoptime, '%Y-%m-%dT%X%z'))
+pprint('-------------------------------------------------------------------')
+pprint('Chunks to migrate: ' + str(iterations))
+pprint('-------------------------------------------------------------------')
+
+# Migrate chunks in parallel across processes ---------------------------------
+# Every chunk covers a disjoint time range, so they can be fanned out to
+# worker processes for true CPU parallelism in the transform loop. The
+# resume point only advances over a contiguous prefix of completed chunks.
+if args.workers > 1:
+    pprint(f'Migrating with {args.workers} worker processes')
+
+    total_read = 0
+    total_written = 0
+    completed = set()
+    next_chunk = 0
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {}
+        for idx, (chunk_start, chunk_end) in enumerate(chunklist):
+            chunk_start_str = utc_str(chunk_start)
+            chunk_end_str = utc_str(chunk_end)
+            futures[executor.submit(migrate_chunk, chunk_start_str, chunk_end_str)] = idx
+
+        for future in as_completed(futures):
+            idx = futures[future]
+            records_read, records_written = future.result()
+
+            total_read += records_read
+            total_written += records_written
+
+            pprint(f'Chunk {idx + 1}/{iterations} done - records read: '
+                   f'{records_read} - records written: {records_written}')
+
+            completed.add(idx)
+            while next_chunk in completed:
+                progress['last_completed'] = chunklist[next_chunk][1].isoformat()
+                next_chunk += 1
+            save_progress(progress)
+
+            if stop_requested:
+                # Chunks that have not started yet are cancelled; the
+                # ones already running finish first (results past the
+                # resume point are simply redone on the next run)
+                pprint('Stop requested - waiting for the running chunks')
+                executor.shutdown(cancel_futures=True)
+                break
+
+    pprint('-------------------------------------------------------------------')
+    pprint(f'Migration done - total records read: {total_read} - written: {total_written}')
+    pprint('-------------------------------------------------------------------')
+    sys.exit(0)
+
+# Migrate chunk by chunk ------------------------------------------------------
+# The reader thread streams raw record batches from InfluxDB 2.x onto a
+# bounded queue while the main thread transforms and writes them to
+# InfluxDB 3, so the read of chunk i+1 overlaps the write of chunk i.
+# save_progress is only ever called from the main (writer) thread so the
+# resume semantics stay correct.
+record_queue = queue.Queue(maxsize=4)
+
+
+def read_chunks(q):
+    iteration = 1
+    try:
+        for chunk_start, chunk_end in chunklist:
+            chunk_start_str = utc_str(chunk_start)
+            chunk_end_str = utc_str(chunk_end)
+
+            pprint(f'Chunk {iteration}/{iterations}: {chunk_start_str} -> {chunk_end_str}')
+
+            flux_query = build_flux_query(chunk_start_str, chunk_end_str)
+
+            rows_iter = ifdbc2_query.query_csv(flux_query)
+            for header, rows in iter_row_batches(rows_iter):
+                q.put(('rows', (header, rows)))
+
+            q.put(('chunkdone', chunk_end))
+
+            if stop_requested:
+                break
+
+            iteration += 1
+    except Exception as e:
+        # Hand the failure over to the main thread - it re-raises there.
+        # Dying without the sentinel would leave it blocked on the queue
+        # forever
+        q.put(('readfailed', e))
+    finally:
+        q.put(None)
+
+
+reader = threading.Thread(target=read_chunks, args=(record_queue,), daemon=True)
+reader.start()
+
+total_read = 0
+total_written = 0
+chunk_read = 0
+chunk_written = 0
+
+while True:
+    item = record_queue.get()
+
+    if item is None:
+        reader.join()
+        break
+
+    kind, payload = item
+
+    if kind == 'rows':
+        header, rows = payload
+        records_read, records_written = process_rows(header, rows, ifdbc3)
+        chunk_read += records_read
+        chunk_written += records_written
+    elif kind == 'readfailed':
+        # Progress was last saved at the preceding chunkdone, so a rerun
+        # resumes right before the chunk that failed
+        reader.join()
+        raise payload
+    else:
+        pprint(f'Records read: {chunk_read} - records written: {chunk_written}')
+        total_read += chunk_read
+        total_written += chunk_written
+        chunk_read = 0
+        chunk_written = 0
+
+        progress['last_completed'] = payload.isoformat()
+        save_progress(progress)
+
+        if stop_requested:
+            # The reader is a daemon thread and may still be blocked on the
+            # queue - it is reaped on interpreter exit
+            pprint('Stop requested - progress saved, exiting')
+            break
+
+pprint('-------------------------------------------------------------------')
+pprint(f'Migration done - total records read: {total_read} - written: {total_written}')
+pprint('-------------------------------------------------------------------')
@@ -0,0 +1,565 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# -----------------------------------------------------------------------------
+# sensorpush_influxdb2-to-victoriametrics.py, Copyright Bjoern Olausson
+# -----------------------------------------------------------------------------
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# To view the license visit
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.html
+# or write to
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+#
+# This Python 3 program copies the SensorPush measurements collected by
+# sensorpush2.py from InfluxDB 2.x to VictoriaMetrics
+#
+
+import ssl
+import sys
+import gzip
+import queue
+import datetime
+import argparse
+import threading
+import http.client
+import requests
+from pathlib import Path
+from pprint import pprint
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from influxdb_client import InfluxDBClient
+
+homedir = str(Path.home())
+
+CONFIGFILE = f'{homedir}/.sensorpush-vm-migration.conf'
+
+CONFIG_TEMPLATE = '''[INFLUXDB2CONF]
+MEASUREMENT_NAME = SensorPush
+IFDB2_URL = InfluxDB 2.x URL
+IFDB2_PORT = InfluxDB 2.x port
+IFDB2_VERIFY_SSL = InfluxDB 2.x skip verifying SSL certificate
+IFDB2_TOKEN = InfluxDB 2.x token
+IFDB2_ORG = InfluxDB 2.x Org
+IFDB2_BUCKET = InfluxDB 2.x bucket
+
+[VICTORIAMETRICSCONF]
+VM_MEASUREMENT_NAME = sensorpush
+VM_URL = VictoriaMetrics URL (e.g. http://localhost:8428)
+'''
+
+
+def read_config(path):
+    # The config is flat KEY = VALUE lines, so a 10-line parser does the
+    # job of the whole configparser machinery (and skips its imports on
+    # every orchestrated invocation)
+    conf = {}
+    for line in Path(path).read_text().splitlines():
+        line = line.strip()
+        if not line or line.startswith(('#', ';', '[')):
+            continue
+        key, _, value = line.partition('=')
+        conf[key.strip().upper()] = value.strip()
+    return conf
+
+
+if not Path(CONFIGFILE).is_file():
+    with open(CONFIGFILE, 'w') as f:
+        f.write(CONFIG_TEMPLATE)
+
+    print(f'Wrote a configuration template to {CONFIGFILE}')
+    print('Please fill in your values and run again')
+    sys.exit(0)
+
+config = read_config(CONFIGFILE)
+
+MEASUREMENT_NAME = config['MEASUREMENT_NAME']
+IFDB2_URL = config['IFDB2_URL']
+IFDB2_PORT = int(config['IFDB2_PORT'])
+IFDB2_VERIFY_SSL = config['IFDB2_VERIFY_SSL'].lower() in ('1', 'true', 'yes', 'on')
+IFDB2_TOKEN = config['IFDB2_TOKEN']
+IFDB2_ORG = config['IFDB2_ORG']
+IFDB2_BUCKET = config['IFDB2_BUCKET']
+
+VM_MEASUREMENT_NAME = config['VM_MEASUREMENT_NAME']
+VM_URL = config['VM_URL']
+
+# VictoriaMetrics ingests InfluxDB line protocol natively on /write and
+# parses it faster than the JSON import endpoint - and our source is
+# InfluxDB, so no JSON needs to be built at all. VM names the resulting
+# metrics measurement_field, which matches the naming used so far.
+VM_WRITE_PATH = '/write?precision=ms'
+
+vm_url_parts = urlsplit(VM_URL)
+
+
+def vm_connect():
+    # One raw keep-alive connection for all batch POSTs - http.client skips
+    # the per-request header normalization and response buffering that
+    # requests does, which adds up over hundreds of batches
+    if vm_url_parts.scheme == 'https':
+        return http.client.HTTPSConnection(vm_url_parts.hostname,
+                                           vm_url_parts.port,
+                                           context=ssl.create_default_context(),
+                                           timeout=60)
+    else:
+        return http.client.HTTPConnection(vm_url_parts.hostname,
+                                          vm_url_parts.port,
+                                          timeout=60)
+
+
+# Lazily opened by the writer thread, reconnected when the server drops
+# the keep-alive between batches
+vm_conn = None
+
+parser = argparse.ArgumentParser(
+    description='Copies the SensorPush measurements written by sensorpush2.py\
+                from InfluxDB 2.x to VictoriaMetrics')
+parser.add_argument(
+    '-s',
+    '--start',
+    dest='starttime',
+    default='',
+    type=str,
+    help='Copy data starting at time (e.g. "2019-07-25T00:10:41+0200")')
+parser.add_argument(
+    '-p',
+    '--stop',
+    dest='stoptime',
+    default='',
+    type=str,
+    help='Copy data up to time (e.g. "2019-07-26T00:10:41+0200")')
+parser.add_argument(
+    '-a',
+    '--all',
+    dest='migrate_all',
+    action='store_true',
+    help='Copy everything from the earliest datapoint found in InfluxDB 2.x')
+parser.add_argument(
+    '-c',
+    '--chunkdays',
+    dest='chunkdays',
+    default='7',
+    type=int,
+    help='Time chunk per query (in days) to copy (default 7 days)')
+parser.add_argument(
+    '-b',
+    '--batchsize',
+    dest='batch_size',
+    default='10000',
+    type=int,
+    help='Number of datapoints to accumulate before writing them to\
+         VictoriaMetrics')
+parser.add_argument(
+    '-w',
+    '--workers',
+    dest='workers',
+    default='0',
+    type=int,
+    help='Number of threads fetching chunks in parallel\
+         (default: min(8, number of chunks))')
+parser.add_argument(
+    '-n',
+    '--nocompress',
+    dest='nocompress',
+    action='store_true',
+    help='Do not gzip the request body sent to VictoriaMetrics\
+        (for debugging)')
+parser.add_argument(
+    '-v',
+    '--verbose',
+    dest='verbose',
+    action='store_true',
+    help='Print a sample of the first datapoint written')
+parser.add_argument(
+    '-x',
+    '--dryrun',
+    dest='dryrun',
+    action='store_true',
+    help='Do not write anything to VictoriaMetrics,\
+        just print what would have been written')
+
+args = parser.parse_args()
+
+# The handful of tag/field name strings ends up in millions of dict
+# lookups and JSON maps - interned strings compare by pointer there
+TAG_SENSOR_ID = sys.intern('sensor_id')
+TAG_SENSOR_NAME = sys.intern('sensor_name')
+
+# Columns returned by the Flux pivot which are not actual sensor fields -
+# the pure metadata columns are already dropped inside the Flux query
+# ('result' and 'table' can still show up client-side in the DataFrame)
+excluded_keys = frozenset(('_time', '_measurement', 'sensor_id',
+                           'sensor_name', 'result', 'table'))
+
+# Pending line-protocol lines waiting to be flushed as one batch
+vm_lines = []
+pending_datapoints = 0
+batches_written = 0
+total_datapoints = 0
+
+# There are only a handful of distinct series, so the tag string, the
+# target measurement and the derived line prefixes are computed once per
+# series and reused for every chunk
+series_cache = {}
+
+def escape_tag_value(value):
+    # Line protocol requires these characters to be escaped in tag values
+    # (sensor names can contain spaces)
+    return value.replace(',', '\\,').replace(' ', '\\ ').replace('=', '\\=')
+
+
+def write_to_victoriametrics(lines):
+    global batches_written, vm_conn
+
+    if args.verbose and batches_written == 0 and lines:
+        pprint('------------Sample of the first datapoint----------------------')
+        print(lines[0])
+        pprint('----------------------------------------------------------------')
+
+    if args.dryrun:
+        pprint(f'[DRY RUN] Would write a batch of {len(lines)} datapoints')
+    else:
+        body = '\n'.join(lines).encode('utf-8')
+
+        headers = {}
+
+        if not args.nocompress:
+            # The line protocol is highly repetitive (measurement names,
+            # tag keys, timestamp prefixes) - even the fastest gzip level
+            # shrinks it several-fold and cuts the upload time accordingly
+            body = gzip.compress(body, compresslevel=1)
+            headers['Content-Encoding'] = 'gzip'
+
+        for attempt in range(2):
+            try:
+                if vm_conn is None:
+                    vm_conn = vm_connect()
+                vm_conn.request('POST', VM_WRITE_PATH,
+                                body=body,
+                                headers=headers)
+                response = vm_conn.getresponse()
+                response.read()
+                break
+            except (http.client.HTTPException, ConnectionError, OSError):
+                # Stale keep-alive connection - reconnect once and retry
+                if vm_conn is not None:
+                    vm_conn.close()
+                vm_conn = None
+                if attempt == 1:
+                    raise
+
+        if response.status >= 300:
+            raise RuntimeError(
+                f'VictoriaMetrics returned HTTP {response.status}')
+
+    batches_written += 1
+
+
+# A single background thread POSTs the ready batches to VictoriaMetrics
+# while the main thread keeps querying InfluxDB - both sides are network
+# bound, so the next chunk downloads while the previous one uploads
+write_queue = queue.Queue(maxsize=4)
+write_failed = threading.Event()
+
+
+def vm_writer():
+    while True:
+        lines = write_queue.get()
+        if lines is None:
+            break
+        if write_failed.is_set():
+            # Keep draining (and discarding) so producers blocked on a
+            # full queue get unstuck - the failure is picked up between
+            # chunk results and ends the run from there
+            continue
+        try:
+            write_to_victoriametrics(lines)
+        except Exception as e:
+            pprint(f'Write to VictoriaMetrics failed: {e}')
+            write_failed.set()
+
+
+def flush_lines():
+    global vm_lines, pending_datapoints
+
+    if vm_lines:
+        # The writer thread owns the handed-over list; a fresh one is
+        # started for the next batch
+        write_queue.put(vm_lines)
+        vm_lines = []
+        pending_datapoints = 0
+
+
+def process_records(df):
+    global pending_datapoints, total_datapoints
+
+    records_read = len(df.index)
+
+    if records_read == 0:
+        return 0
+
+    # Bind the hot lookups once per chunk - LOAD_FAST beats an attribute
+    # dict lookup on every iteration of the field loop
+    batch_size = args.batch_size
+    dryrun = args.dryrun
+
+    # One vectorized pass for the timestamp conversion instead of a
+    # get_time()/timestamp() call per record - viewing the datetime64[ns]
+    # buffer as int64 is free, only the // allocates (and it stays exact,
+    # no float64 round-trip involved)
+    df = df.assign(_ts_ms=df['_time'].values.view('int64') // 1_000_000)
+
+    field_names = [sys.intern(c) for c in df.columns
+                   if c not in excluded_keys and c != '_ts_ms']
+
+    grouping = ['_measurement']
+    if TAG_SENSOR_ID in df.columns:
+        grouping.append(TAG_SENSOR_ID)
+    if TAG_SENSOR_NAME in df.columns:
+        grouping.append(TAG_SENSOR_NAME)
+
+    # Emit whole series at a time: group the chunk by measurement/sensor and
+    # slice each field column with a validity mask - the float casts and the
+    # NaN filtering run as C-level array ops instead of a per-row try/except
+    for group_vals, gdf in df.groupby(grouping, sort=False):
+        if not isinstance(group_vals, tuple):
+            group_vals = (group_vals,)
+
+        cached = series_cache.get(group_vals)
+        if cached is None:
+            series = dict(zip(grouping, group_vals))
+
+            rec_measurement = series['_measurement']
+
+            if rec_measurement.endswith('_V'):
+                target_measurement = f'{VM_MEASUREMENT_NAME}_V'
+            else:
+                target_measurement = VM_MEASUREMENT_NAME
+
+            tag_tokens = []
+            if series.get(TAG_SENSOR_ID) is not None:
+                tag_tokens.append(
+                    f'{TAG_SENSOR_ID}='
+                    f'{escape_tag_value(str(series[TAG_SENSOR_ID]))}')
+            if series.get(TAG_SENSOR_NAME) is not None:
+                tag_tokens.append(
+                    f'{TAG_SENSOR_NAME}='
+                    f'{escape_tag_value(str(series[TAG_SENSOR_NAME]))}')
+
+            tag_str = ','.join(tag_tokens)
+
+            cached = (tag_str, target_measurement, {})
+            series_cache[group_vals] = cached
+
+        tag_str, target_measurement, lp_prefixes = cached
+
+        gts = gdf['_ts_ms'].to_numpy()
+
+        for field_name in field_names:
+            values = gdf[field_name].astype('float64').to_numpy()
+
+            # NaN marks the gaps the pivot leaves for unreported fields
+            mask = values == values
+            if not mask.any():
+                continue
+
+            # Everything up to the field value is constant per
+            # (series, field) - VM turns this into a metric named
+            # measurement_field, same naming as the JSON import used
+            prefix = lp_prefixes.get(field_name)
+            if prefix is None:
+                prefix = f'{target_measurement},{tag_str} {field_name}='
+                lp_prefixes[field_name] = prefix
+
+            datapoints = int(mask.sum())
+
+            if dryrun:
+                # A dry run only tallies - formatting millions of lines
+                # that are never sent would be pure waste. One sample
+                # line is shown for the very first datapoint.
+                if total_datapoints == 0:
+                    pprint('[DRY RUN] Sample of the first datapoint:')
+                    pprint(f'{prefix}{values[mask][0]} {gts[mask][0]}')
+                total_datapoints += datapoints
+                continue
+
+            vm_lines.extend(
+                f'{prefix}{v} {t}'
+                for v, t in zip(values[mask].tolist(), gts[mask].tolist()))
+
+            pending_datapoints += datapoints
+            total_datapoints += datapoints
+
+            if pending_datapoints >= batch_size:
+                flush_lines()
+
+    return records_read
+
+
+def build_flux_query(chunk_start_str, chunk_end_str):
+    flux_query = f'''
+from(bucket: "{IFDB2_BUCKET}")
+  |> range(start: {chunk_start_str}, stop: {chunk_end_str})
+  |> filter(fn: (r) => r._measurement == "{MEASUREMENT_NAME}" or r._measurement == "{MEASUREMENT_NAME}_V")
+  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+  |> drop(columns: ["_start", "_stop", "result", "table"])
+'''
+    return flux_query
+
+
+# Initiate the InfluxDB client ------------------------------------------------
+ifdbc = InfluxDBClient(url=f'{IFDB2_URL}:{IFDB2_PORT}',
+                       token=IFDB2_TOKEN,
+                       org=IFDB2_ORG,
+                       verify_ssl=IFDB2_VERIFY_SSL,
+                       timeout=300_000)
+ifdbc_read = ifdbc.query_api()
+
+# Figure out the time range to copy -------------------------------------------
+currenttime = datetime.datetime.now(datetime.timezone.utc)
+
+if args.migrate_all:
+    # Probe InfluxDB 2.x via the InfluxQL compatibility endpoint for the
+    # earliest datapoint of the measurement
+    pprint('Fetching the earliest datapoint from InfluxDB 2.x')
+    influxql_url = f'{IFDB2_URL}:{IFDB2_PORT}/query'
+    # Selecting a single field keeps the response to one timestamp/value
+    # pair instead of every field of the row
+    influxql_query = (f'SELECT temperature FROM "{MEASUREMENT_NAME}" '
+                      f'ORDER BY time ASC LIMIT 1')
+    response = requests.get(influxql_url,
+                            params={'db': IFDB2_BUCKET, 'q': influxql_query},
+                            headers={'Authorization': f'Token {IFDB2_TOKEN}'},
+                            verify=IFDB2_VERIFY_SSL)
+
+    if response.status_code != 200:
+        pprint('Could not fetch the earliest datapoint')
+        pprint(response)
+        sys.exit()
+
+    result = response.json()
+
+    try:
+        first_time = result['results'][0]['series'][0]['values'][0][0]
+    except (KeyError, IndexError) as e:
+        pprint(f'No data found in InfluxDB 2.x for measurement {MEASUREMENT_NAME}')
+        sys.exit()
+
+    starttime = datetime.datetime.fromisoformat(first_time.replace('Z', '+00:00'))
+elif args.starttime:
+    starttime = datetime.datetime.strptime(args.starttime, '%Y-%m-%dT%X%z')
+else:
+    print('You must specify either --start or --all')
+    sys.exit(0)
+
+if args.stoptime:
+    stoptime = datetime.datetime.strptime(args.stoptime, '%Y-%m-%dT%X%z')
+else:
+    stoptime = currenttime
+
+def utc_str(ts):
+    """Render a chunk boundary as the UTC instant Flux range() expects."""
+    # strftime alone would print the local wall-clock time with a
+    # literal Z, shifting the window for offset-aware --start/--stop
+    return datetime.date.strftime(ts.astimezone(datetime.timezone.utc),
+                                  '%Y-%m-%dT%H:%M:%SZ')
+
+
+# Build the list of time chunks to copy ---------------------------------------
+chunks = []
+chunk_start = starttime
+while chunk_start < stoptime:
+    chunk_end = min(chunk_start + datetime.timedelta(days=args.chunkdays), stoptime)
+    chunks.append([chunk_start, chunk_end])
+    chunk_start = chunk_end
+
+iterations = len(chunks)
+
+pprint('-------------------------------------------------------------------')
+pprint('Start: ' + datetime.date.strftime(starttime, '%Y-%m-%dT%X%z'))
+pprint('Stop:  ' + datetime.date.strftime(stoptime, '%Y-%m-%dT%X%z'))
+pprint('-------------------------------------------------------------------')
+pprint('Chunks to copy: ' + str(iterations))
+pprint('-------------------------------------------------------------------')
+
+writer = threading.Thread(target=vm_writer, daemon=True)
+writer.start()
+
+# The batch state (vm_lines, counters, series_cache) is shared,
+# so the transform runs under a lock - the chunk queries themselves fan
+# out in parallel, which is where the wall time goes
+process_lock = threading.Lock()
+
+
+def run_chunk(i, chunk_start, chunk_end):
+    chunk_start_str = utc_str(chunk_start)
+    chunk_end_str = utc_str(chunk_end)
+
+    pprint(f'Chunk {i + 1}/{iterations}: {chunk_start_str} -> {chunk_end_str}')
+
+    flux_query = build_flux_query(chunk_start_str, chunk_end_str)
+
+    # query_data_frame hands the chunk over as pandas DataFrames - no
+    # per-row FluxRecord objects or values dicts get built at all
+    result = ifdbc_read.query_data_frame(flux_query)
+
+    if not isinstance(result, list):
+        result = [result]
+
+    records_read = 0
+    with process_lock:
+        for df in result:
+            records_read += process_records(df)
+
+    return records_read
+
+
+total_records = 0
+
+workers = args.workers if args.workers > 0 else min(8, max(iterations, 1))
+
+if workers > 1:
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        chunk_results = executor.map(run_chunk,
+                                     range(iterations),
+                                     [c[0] for c in chunks],
+                                     [c[1] for c in chunks])
+        for records_read in chunk_results:
+            total_records += records_read
+
+            if write_failed.is_set():
+                pprint('Stopping - the writer thread reported an error')
+                sys.exit(1)
+else:
+    for i, (chunk_start, chunk_end) in enumerate(chunks):
+        total_records += run_chunk(i, chunk_start, chunk_end)
+
+        if write_failed.is_set():
+            pprint('Stopping - the writer thread reported an error')
+            sys.exit(1)
+
+# Write whatever is left over, then let the writer drain the queue
+flush_lines()
+write_queue.put(None)
+writer.join()
+
+if write_failed.is_set():
+    pprint('The writer thread reported an error')
+    sys.exit(1)
+
+pprint('-------------------------------------------------------------------')
+pprint(f'Done - records read: {total_records} - datapoints written: {total_datapoints}')
+pprint(f'Batches written: {batches_written}')
+pprint('-------------------------------------------------------------------')
@@ -0,0 +1,908 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# -----------------------------------------------------------------------------
+# sensorpush_victoriametrics.py, Copyright Bjoern Olausson
+# -----------------------------------------------------------------------------
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# To view the license visit
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.html
+# or write to
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+# 02110-1301 USA
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+#
+# This Python 3 program is intended to query the SensorPush API and
+# persistantly store temperature and humidity values in VictoriaMetrics
+# (via its InfluxDB line protocol /write endpoint)
+#
+
+import re
+import ssl
+import sys
+import json
+import time
+import zlib
+import requests
+import datetime
+import argparse
+import configparser
+import numpy as np
+from pathlib import Path
+from pprint import pprint
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from requests.packages.urllib3.exceptions import InsecureRequestWarning
+
+# orjson serializes straight to bytes and parses the multi-MB samples
+# response a few times faster than stdlib json - fall back when absent
+try:
+    import orjson
+
+    def json_dumps(obj):
+        return orjson.dumps(obj)
+
+    def json_loads(data):
+        return orjson.loads(data)
+except ImportError:
+    def json_dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+    def json_loads(data):
+        return json.loads(data)
+
+# Verify TLS certificates by default - that is also the cheap path,
+# since urllib3 neither builds throwaway SSL contexts nor raises
+# InsecureRequestWarning per request. Set to False only when talking to
+# endpoints with self-signed certificates.
+VERIFY_SSL = True
+
+if VERIFY_SSL:
+    adapter_cls = HTTPAdapter
+else:
+    requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+
+    # One relaxed context, built once and shared by every pooled
+    # connection instead of being recreated under the hood per request
+    insecure_ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    insecure_ctx.check_hostname = False
+    insecure_ctx.verify_mode = ssl.CERT_NONE
+
+    class InsecureAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            kwargs['ssl_context'] = insecure_ctx
+            return super().init_poolmanager(*args, **kwargs)
+
+    adapter_cls = InsecureAdapter
+
+homedir = str(Path.home())
+
+CONFIGFILE = f'{homedir}/.sensorpush_vm.conf'
+
+TOKENFILE = f'{homedir}/.sensorpush_vm.token'
+TOKEN_LIFETIME = 3600
+
+RETRYWAIT = 60
+MAXRETRY = 3
+BATCH_SIZE = 5000
+
+API_URL_BASE = 'https://api.sensorpush.com/api/v1'
+API_URL_OA_AUTH = f'{API_URL_BASE}/oauth/authorize'
+API_URL_OA_ATOK = f'{API_URL_BASE}/oauth/accesstoken'
+API_URL_GW = f'{API_URL_BASE}/devices/gateways'
+API_URL_SE = f'{API_URL_BASE}/devices/sensors'
+API_URL_SPL = f'{API_URL_BASE}/samples'
+API_URL_RPL = f'{API_URL_BASE}/reports/list'
+
+MEASUREMENT_NAME = 'SensorPush'
+
+HTTP_OA_HEAD = {'accept': 'application/json',
+                'Content-Type': 'application/json'}
+
+config = configparser.ConfigParser()
+
+if not Path(CONFIGFILE).is_file():
+    config['SONSORPUSHAPI'] = {
+        'LOGIN': 'SensorPush login',
+        'PASSWD': 'SensorPush password'
+    }
+    config['VICTORIAMETRICSCONF'] = {
+        'VM_URL': 'VictoriaMetrics URL (e.g. http://localhost:8428)'
+    }
+    config['MISC'] = {
+        'MY_ALTITUDE': 'Metres above sea level'
+    }
+    with open(CONFIGFILE, 'w') as f:
+        config.write(f)
+
+    print(f'Wrote a configuration template to {CONFIGFILE}')
+    print('Please fill in your values and run again')
+    sys.exit(0)
+else:
+    config.read(CONFIGFILE)
+
+LOGIN = config['SONSORPUSHAPI']['LOGIN']
+PASSWD = config['SONSORPUSHAPI']['PASSWD']
+VM_URL = config['VICTORIAMETRICSCONF']['VM_URL']
+MY_ALTITUDE = config['MISC']['MY_ALTITUDE']
+
+VM_WRITE_URL = f'{VM_URL}/write?precision=ns'
+
+try:
+    MY_ALTITUDE = float(MY_ALTITUDE)
+except ValueError as e:
+    print(f'MY_ALTITUDE is not set to a valid number: {MY_ALTITUDE}')
+    sys.exit()
+
+parser = argparse.ArgumentParser(
+    description='Queries the SensorPush API and stores the temp and humidity\
+                readings in VictoriaMetrics')
+parser.add_argument(
+    '-s',
+    '--start',
+    dest='starttime',
+    default='',
+    type=str,
+    help='start query at time (e.g. "2019-07-25T00:10:41+0200")')
+parser.add_argument(
+    '-p',
+    '--stop',
+    dest='stoptime',
+    default='',
+    type=str,
+    help='Stop query at time (e.g. "2019-07-26T00:10:41+0200")')
+parser.add_argument(
+    '-b',
+    '--backlog',
+    dest='backlog',
+    default='1d',
+    type=str,
+    help='Historical data to fetch (default 1 day) - time can be specified in the format <number>[m|h|d|w|M|Y]. E.g.: 10 Minutes = 10m, 1 day = 1d, 1 month = 1M')
+parser.add_argument(
+    '-t',
+    '--timestep',
+    dest='timestep',
+    default='720',
+    type=int,
+    help='Time slice per query (in minutes) to fetch\
+         (default 720 minutes [12 h])')
+parser.add_argument(
+    '-q',
+    '--querylimit',
+    dest='qlimit',
+    default='0',
+    type=int,
+    help='Number of samples to return per sensor (default unset = API default limit [10])')
+parser.add_argument('-d',
+                    '--delay',
+                    dest='delay',
+                    default='60',
+                    type=int,
+                    help='Delay in seconds between queries')
+parser.add_argument(
+    '-l',
+    '--listsensors',
+    dest='listsensors',
+    action='store_true',
+    help='Show a list of sensors and exit')
+parser.add_argument(
+    '-g',
+    '--listgateways',
+    dest='listgateways',
+    action='store_true',
+    help='Show a list of gateways and exit')
+parser.add_argument(
+    '-i',
+    '--sensorlist',
+    dest='sensorlist',
+    nargs='+',
+    type=str,
+    help='List of sensor IDs to query')
+parser.add_argument(
+    '-n',
+    '--noconvert',
+    dest='noconvert',
+    action='store_true',
+    help='Do not convert °F to °C, inHG to mBar, kPa to mBar and feet to meters')
+parser.add_argument(
+    '-x',
+    '--dryrun',
+    dest='dryrun',
+    action='store_true',
+    help='Do not write anything to the database,\
+        just print what would have been written')
+
+args = parser.parse_args()
+
+starttime = args.starttime
+stoptime = args.stoptime
+timesteps = args.timestep
+qlimit = args.qlimit
+delay = args.delay
+listsensors = args.listsensors
+listgateways = args.listgateways
+sensorlist = args.sensorlist
+noconvert = args.noconvert
+dryrun = args.dryrun
+
+backlogstring = args.backlog
+
+# Convert backlog to minutes
+minutes_per_unit = {"m": 1, "h": 60, "d": 60*24, "w": 60*24*7, "M": 60*24*30.417, "Y": 60*24*365}
+backlogmatch = re.match(r'^(\d+(?:\.\d+)?)([mhdwMY])$', backlogstring)
+if backlogmatch is None:
+    print(f'Invalid backlog "{backlogstring}" - '
+          f'expected <number>[m|h|d|w|M|Y], e.g. 10m, 1.5d or 1M')
+    sys.exit()
+backlog = int(float(backlogmatch.group(1))
+              * minutes_per_unit[backlogmatch.group(2)])
+
+
+def local_time_offset(t=None):
+    """Return offset of local zone from GMT, either at present or at time t."""
+    # python2.3 localtime() can't take None
+    if t is None:
+        t = time.time()
+
+    if time.localtime(t).tm_isdst and time.daylight:
+        return -time.altzone / 3600
+    else:
+        return -time.timezone / 3600
+
+
+# One C-level translate pass instead of three sequential str.replace
+# scans per tag value / field key
+ESCAPE_TABLE = str.maketrans({',': '\\,', ' ': '\\ ', '=': '\\='})
+
+
+def escape_tag_value(value):
+    """Escape the characters line protocol treats specially in tag values."""
+    return str(value).translate(ESCAPE_TABLE)
+
+
+def escape_field_key(value):
+    """Escape the characters line protocol treats specially in field keys."""
+    return str(value).translate(ESCAPE_TABLE)
+
+
+# The converters take whole NumPy arrays, not single samples - and since
+# noconvert is fixed after argument parsing, the right variant is bound
+# once here rather than re-testing the flag on every call. No rounding:
+# VictoriaMetrics stores and compresses float64 just fine, and rounding
+# only discards precision while costing an extra array pass
+if noconvert:
+    def F_to_C(F):
+        return F
+
+    def ft_to_m(ft):
+        return ft
+
+    def inHg_to_mBar(inHg):
+        return inHg
+
+    def kPa_to_mBar(kPa):
+        return kPa
+else:
+    def F_to_C(F):
+        return (F - 32) * 5.0 / 9.0
+
+    def ft_to_m(ft):
+        return ft * 0.3048
+
+    def inHg_to_mBar(inHg):
+        return inHg * 33.8639
+
+    def kPa_to_mBar(kPa):
+        return kPa * 10
+
+
+def make_tag_prefix(measurement, tags):
+    """Build the invariant measurement,tag_set part of a line once."""
+    tag_set = ','.join(
+        f'{escape_tag_value(k)}={escape_tag_value(v)}'
+        for k, v in tags.items())
+    return f'{measurement},{tag_set}'
+
+
+# One dict lookup on the exact type instead of an isinstance cascade per
+# field - and since the keys are exact types, bool (an int subclass)
+# cannot be swallowed by the int entry
+FIELD_FORMATS = {
+    bool: lambda key, v: f'{key}={str(v).lower()}',
+    int: lambda key, v: f'{key}={v}i',
+    float: lambda key, v: f'{key}={v}',
+    str: lambda key, v: f'{key}="{v}"',
+}
+
+
+def emit_line(out, tag_prefix, fields, ts_ns):
+    """Append one line protocol line to out as ready-to-concat pieces.
+
+    No intermediate field_set string or per-line join - the pieces go
+    straight into the streaming writer (newline included).
+    """
+    out.append(tag_prefix)
+    sep = ' '
+    for k, v in fields.items():
+        key = escape_field_key(k)
+        fmt = FIELD_FORMATS.get(type(v), FIELD_FORMATS[str])
+        out.append(sep + fmt(key, v))
+        sep = ','
+    out.append(f' {ts_ns}\n')
+
+
+def write_to_victoriametrics(pieces):
+    if not pieces:
+        return
+
+    if dryrun:
+        print('------------Data that would have been written---------')
+        sys.stdout.write(''.join(pieces))
+        print('------------------------------------------------------')
+        return
+
+    # Compressing piece by piece into a generator streams the body with
+    # chunked transfer encoding - the payload never exists in memory as
+    # one joined string, let alone its encoded and compressed copies
+    def gzip_body(chunk_bytes=64 * 1024):
+        # wbits 31 = deflate with gzip framing
+        co = zlib.compressobj(3, zlib.DEFLATED, 31)
+        buf = bytearray()
+        for piece in pieces:
+            buf += co.compress(piece.encode('utf-8'))
+            if len(buf) >= chunk_bytes:
+                yield bytes(buf)
+                buf.clear()
+        buf += co.flush()
+        if buf:
+            yield bytes(buf)
+
+    # Server errors are retried here with a fresh generator - the
+    # adapter must not replay the spent one (it would send an empty
+    # body that VictoriaMetrics happily accepts, dropping the batch)
+    for attempt in range(1, MAXRETRY + 1):
+        r = vm_session.post(VM_WRITE_URL,
+                            data=gzip_body(),
+                            headers={'Content-Encoding': 'gzip'},
+                            verify=VERIFY_SSL)
+
+        if r.status_code < 300:
+            return
+
+        print(f'VictoriaMetrics returned HTTP {r.status_code} '
+              f'(try {attempt}/{MAXRETRY})')
+
+        if attempt < MAXRETRY:
+            time.sleep(RETRYWAIT)
+
+    raise ValueError(f'VictoriaMetrics returned HTTP {r.status_code}')
+
+
+# Try to get the proper UTC time offset ---------------------------------------
+mytz = datetime.timezone(datetime.timedelta(hours=local_time_offset()))
+currenttime = datetime.datetime.now(tz=mytz)
+querytime = currenttime
+
+if not starttime:
+    starttime = currenttime - datetime.timedelta(minutes=int(backlog))
+else:
+    starttime = datetime.datetime.strptime(args.starttime, '%Y-%m-%dT%X%z')
+
+if not stoptime:
+    stoptime = currenttime
+else:
+    stoptime = datetime.datetime.strptime(args.stoptime, '%Y-%m-%dT%X%z')
+
+starttimestr = 'Start: ' + datetime.date.strftime(starttime, '%Y-%m-%dT%X%z')
+stoptimestr = 'Stop:  ' + datetime.date.strftime(stoptime, '%Y-%m-%dT%X%z')
+
+# Build the query time slices - each slice starts 30 minutes before the
+# previous one stopped to catch samples right at a slice border
+step = datetime.timedelta(minutes=timesteps)
+overlap = datetime.timedelta(minutes=30)
+
+span = stoptime - starttime
+nslices = max(span // step + (1 if span % step else 0), 1)
+
+timelist = [
+    [datetime.date.strftime(max(starttime, starttime + i * step - overlap),
+                            '%Y-%m-%dT%X%z'),
+     datetime.date.strftime(starttime + (i + 1) * step, '%Y-%m-%dT%X%z')]
+    for i in range(nslices)
+]
+
+iterations = len(timelist)
+
+# Set retries for requests ----------------------------------------------------
+# One retry policy for every API endpoint (auth included) instead of a
+# hand-rolled retry loop around just the authorize call
+api_retry = Retry(total=MAXRETRY,
+                  connect=MAXRETRY,
+                  read=MAXRETRY,
+                  backoff_factor=2,
+                  status_forcelist=[429, 500, 502, 503, 504],
+                  allowed_methods=['POST'])
+s = requests.Session()
+s.mount(API_URL_BASE, adapter_cls(max_retries=api_retry))
+
+# A dedicated session for VictoriaMetrics keeps one TCP (and TLS)
+# connection alive across all write batches. Only connection
+# establishment is retried here - the streamed chunked body cannot be
+# replayed by urllib3 (the generator is spent after one send), so
+# server errors are retried in write_to_victoriametrics with a fresh
+# body instead
+vm_retry = Retry(total=None,
+                 connect=5,
+                 read=0,
+                 status=0,
+                 backoff_factor=0.5,
+                 allowed_methods=['POST'])
+vm_session = requests.Session()
+vm_session.mount(VM_URL, adapter_cls(max_retries=vm_retry,
+                                     pool_connections=1,
+                                     pool_maxsize=2))
+
+
+# get API oauth access token --------------------------------------------------
+def fetch_access_token():
+    """Run the two OAuth round trips and cache the token on disk."""
+    print('Fetching API oauth authorization string')
+    HTTP_DATA = json_dumps({'email': LOGIN, 'password': PASSWD})
+
+    try:
+        r = s.post(API_URL_OA_AUTH,
+                   headers=HTTP_OA_HEAD,
+                   data=HTTP_DATA,
+                   verify=VERIFY_SSL)
+    except requests.exceptions.ConnectionError as e:
+        print(f'Auth request failed after {MAXRETRY} retries')
+        pprint(e)
+        sys.exit()
+
+    if r.status_code == 200:
+        auth = r.content
+    else:
+        print('Auth request failed')
+        pprint(r)
+        sys.exit()
+
+    print('Fetching API oauth access token')
+    r = s.post(API_URL_OA_ATOK,
+               headers=HTTP_OA_HEAD,
+               data=auth,
+               verify=VERIFY_SSL)
+
+    if r.status_code == 200:
+        atok = json_loads(r.content)['accesstoken']
+    else:
+        print('Access token request failed')
+        pprint(r)
+        sys.exit()
+
+    try:
+        with open(TOKENFILE, 'w') as f:
+            json.dump({'accesstoken': atok,
+                       'expires_at': time.time() + TOKEN_LIFETIME}, f)
+    except OSError as e:
+        # A failed cache write only costs the next run two extra calls
+        pprint(e)
+
+    return atok
+
+
+def load_cached_token():
+    """Return the cached access token if it is still good for a while."""
+    try:
+        with open(TOKENFILE) as f:
+            cached = json.load(f)
+    except (OSError, ValueError) as e:
+        return None
+
+    if cached.get('expires_at', 0) - time.time() > 300:
+        return cached.get('accesstoken')
+
+    return None
+
+
+# For a cron-driven poller the two OAuth round trips per run add up -
+# tokens are valid for about an hour, so reuse the last one if possible
+atok = load_cached_token()
+
+if atok:
+    print('Using the cached API access token')
+else:
+    atok = fetch_access_token()
+
+# Create header for further requests:
+HTTP_HEAD = {'accept': 'application/json',
+             'Authorization': atok}
+
+def post_json(url, what):
+    """POST an empty body to an API endpoint and return the parsed JSON."""
+    r = s.post(url,
+               headers=HTTP_HEAD,
+               data=json_dumps({}),
+               verify=VERIFY_SSL)
+
+    if r.status_code != 200:
+        print(f'Could not fetch {what}')
+        pprint(r)
+        sys.exit()
+
+    return json_loads(r.content)
+
+
+# Get gateways, bulk reports and sensors --------------------------------------
+# The three inventory calls are independent of each other - dispatched
+# together they cost one round trip instead of three
+print('Fetching the lists of gateways, bulk reports and sensors')
+with ThreadPoolExecutor(max_workers=3) as pool:
+    gateways_f = pool.submit(post_json, API_URL_GW, 'the list of gateways')
+    reports_f = pool.submit(post_json, API_URL_RPL, 'the list of bulk reports')
+    sensors_f = pool.submit(post_json, API_URL_SE, 'the list of sensors')
+
+    gateways = gateways_f.result()
+    reports = reports_f.result()
+    sensors = sensors_f.result()
+
+if listgateways:
+    for id, gw in gateways.items():
+        gwname = gw["name"]
+        print(f'---------------{gwname}---------------')
+        print(f'Last alert               : {gw["last_alert"]}')
+        print(f'Last seen                : {gw["last_seen"]}')
+        print(f'Message                  : {gw["message"]}')
+        print(f'Paired                   : {gw["paired"]}')
+        print(f'Version                  : {gw["version"]}')
+        print('------------------------------------------------------------')
+        print('')
+
+    sys.exit(0)
+
+
+if len(reports["files"]) > 0:
+    print("Bulk reports to download:")
+    for file in reports["files"]:
+        pprint(file)
+
+# The full tag prefix for every known sensor, escaped once up front -
+# the sample loop is left with a plain dict lookup per sensor
+sensor_tag_prefixes = {
+    key: make_tag_prefix(MEASUREMENT_NAME,
+                         {'sensor_id': key,
+                          'sensor_name': str(sensor['name'])})
+    for key, sensor in sensors.items()}
+
+measurement_v = []
+
+for id in sensors.keys():
+    if listsensors:
+        sensorname = sensors[id]["name"]
+        print(f'---------------{sensorname}---------------')
+
+        for key in sensors[id].keys():
+            print(f'{key}: {sensors[id][key]}')
+
+    # dict.get instead of catching KeyError - no exception machinery
+    # for sensors that simply do not report a value
+    BatVolt = sensors[id].get("battery_voltage")
+    if BatVolt is None:
+        if listsensors:
+            print(f'Failed to get battery_voltage for {sensors[id]["name"]}')
+        BatVolt = 0.0
+    else:
+        BatVolt = float(BatVolt)
+
+    RSSI = sensors[id].get("rssi")
+    if RSSI is None:
+        if listsensors:
+            print(f'Failed to get rssi for {sensors[id]["name"]}')
+        RSSI = 0.0
+    else:
+        RSSI = float(RSSI)
+
+    if listsensors:
+        print('------------------------------------------------------------')
+        print('')
+
+    emit_line(measurement_v,
+              make_tag_prefix(f'{MEASUREMENT_NAME}_V',
+                              {'sensor_id': sensors[id]["id"],
+                               'sensor_name': sensors[id]["name"]}),
+              {'voltage': BatVolt, 'rssi': RSSI},
+              int(querytime.timestamp() * 1e9))
+
+if listsensors:
+    sys.exit(0)
+else:
+    write_to_victoriametrics(measurement_v)
+
+# Get samples -----------------------------------------------------------------
+print('-------------------------------------------------------------------')
+print(starttimestr)
+print(stoptimestr)
+print('-------------------------------------------------------------------')
+
+print('Iterations required: ' + str(iterations))
+print('-------------------------------------------------------------------')
+
+iteration = 1
+retrycount = 0
+
+# Line pieces accumulate across time slices and are flushed once
+# BATCH_SIZE samples are buffered - one POST per 5000 samples instead of
+# one per slice
+pending_lines = []
+pending_count = 0
+
+measures = ["altitude", "barometric_pressure", "dewpoint", "humidity",
+            "temperature", "vpd", "distance"]
+
+
+def fetch_slice(timeslice, deadline=0.0):
+    # Wait out the remainder of the rate limit window, if any - the
+    # clock started when the previous query returned, so time spent
+    # processing counts against the delay instead of adding to it
+    remaining = deadline - time.monotonic()
+    if remaining > 0:
+        time.sleep(remaining)
+
+    query = {'startTime': timeslice[0],
+             'stopTime': timeslice[1],
+             'measures': measures}
+
+    if qlimit != 0:
+        query['limit'] = qlimit
+
+    if sensorlist:
+        query['sensors'] = sensorlist
+
+    return s.post(API_URL_SPL,
+                  headers=HTTP_HEAD,
+                  data=json_dumps(query),
+                  verify=VERIFY_SSL)
+
+
+# A single background worker fetches the next time slice while the
+# current one is converted and written, so the loop never sits idle in
+# time.sleep between queries
+prefetch = ThreadPoolExecutor(max_workers=1)
+future = prefetch.submit(fetch_slice, timelist[0]) if timelist else None
+
+# The inter-query delay only matters when polling near real time - a
+# historical backfill has nothing to wait for, so its slices are
+# fetched back to back
+backfilling = stoptime < currenttime - datetime.timedelta(seconds=delay * 2)
+
+try:
+    for idx, item in enumerate(timelist):
+        failed = True
+        slice_buffered = False
+
+        while failed:
+            try:
+                print(f'Iteration {iteration}/{iterations}')
+
+                r = future.result()
+
+                if r.status_code == 200:
+                    samples = json_loads(r.content)
+                else:
+                    if r.status_code == 401:
+                        # The token expired mid-run - drop the cache,
+                        # re-auth and let the retry path fetch this
+                        # slice again with the fresh token
+                        Path(TOKENFILE).unlink(missing_ok=True)
+                        HTTP_HEAD['Authorization'] = fetch_access_token()
+                    raise ValueError('Could not fetch samples')
+
+                # This slice arrived fine - queue the next one (after the
+                # rate limit delay) before crunching this one
+                if idx + 1 < iterations:
+                    if backfilling:
+                        future = prefetch.submit(fetch_slice,
+                                                 timelist[idx + 1])
+                    else:
+                        print(f'Prefetching the next slice in {delay} seconds')
+                        future = prefetch.submit(fetch_slice,
+                                                 timelist[idx + 1],
+                                                 time.monotonic() + delay)
+
+                truncated = samples['truncated']
+                numsamples = samples['total_samples']
+                numsensors = samples['total_sensors']
+
+                print('Request truncated: ' + str(truncated))
+
+                if truncated:
+                    print('You might want to consider reducing the time slices')
+
+                print('Number of samples fetched: ' + str(numsamples))
+                print('Number of sensors queried: ' + str(numsensors))
+
+                # Push data to VictoriaMetrics --------------------------------
+                measurement_lines = []
+                for key, items in samples['sensors'].items():
+                    tag_prefix = sensor_tag_prefixes[key]
+
+                    # One array per measure instead of one try/except per
+                    # sample and field - a missing value becomes NaN and
+                    # simply never makes it into the line protocol
+                    nan = float('nan')
+                    humidity = np.asarray(
+                        [sample.get('humidity', nan) for sample in items],
+                        dtype=np.float64)
+                    temperature = F_to_C(np.asarray(
+                        [sample.get('temperature', nan) for sample in items],
+                        dtype=np.float64))
+                    pressure = inHg_to_mBar(np.asarray(
+                        [sample.get('barometric_pressure', nan) for sample in items],
+                        dtype=np.float64))
+                    altitude = ft_to_m(np.asarray(
+                        [sample.get('altitude', nan) for sample in items],
+                        dtype=np.float64))
+                    distance = ft_to_m(np.asarray(
+                        [sample.get('distance', nan) for sample in items],
+                        dtype=np.float64))
+                    dewpoint = F_to_C(np.asarray(
+                        [sample.get('dewpoint', nan) for sample in items],
+                        dtype=np.float64))
+                    vpd = kPa_to_mBar(np.asarray(
+                        [sample.get('vpd', nan) for sample in items],
+                        dtype=np.float64))
+
+                    has_pressure = pressure == pressure
+
+                    # NaNs propagate harmlessly, so both abs_humidity
+                    # variants run over the whole array at once and
+                    # np.where picks the right one per sample
+                    with np.errstate(invalid='ignore', divide='ignore'):
+                        # Absolute humidity (g/m³)
+                        # https://carnotcycle.wordpress.com/2012/08/04/how-to-convert-relative-humidity-to-absolute-humidity/
+                        TK = temperature + 273.15
+                        abs_humidity_est = (6.112 * np.exp((17.67 * temperature)/(temperature + 243.5)) * humidity * 2.1674) / TK
+
+                        # Absolute humidity (g/m³)
+                        # https://www.loxwiki.eu/display/LOX/Absolute+Luftfeuchtigkeit+berechnen
+                        # The saturation vapour pressure term shows up in both the
+                        # numerator and the denominator - computed once here, as are
+                        # the temperature subterms it keeps reusing
+                        D = TK * TK - 293700.0
+                        xDD = 0.000000000011965 * D * D
+                        svp = (1.01325 * 10.0**(5.426651 - 2005.1 / TK
+                               + 0.00013869 * D / TK * (10.0**xDD - 1.0)
+                               - 0.0044 * 10.0**(-0.0057148 * (374.11 - temperature)**1.25))
+                               + (TK / 647.3 - 0.422) * (0.577 - TK / 647.3)
+                               * np.exp(xDD) * 0.00980665)
+                        abs_humidity_prs = (
+                            0.622 * humidity / 100 * svp
+                            / (pressure / 1000.0 - humidity / 100.0 * svp)
+                            * pressure / 1000.0 * 100000000.0 / (TK * 287.1))
+
+                        abs_humidity = np.where(has_pressure,
+                                                abs_humidity_prs,
+                                                abs_humidity_est)
+
+                        # Dewpoint in degree centigrade
+                        # https://cals.arizona.edu/azmet/dewpoint.html
+                        gamma = (np.log(humidity / 100)
+                                 + (17.27 * temperature) / (237.3 + temperature)) / 17.27
+                        dewpoint_calc = 237.3 * gamma / (1 - gamma)
+                        dewpoint = np.where(dewpoint == dewpoint,
+                                            dewpoint,
+                                            dewpoint_calc)
+
+                        # Vapor Pressure Deficit in mBar
+                        # https://pulsegrow.com/blogs/learn/vpd
+                        vpd_calc = kPa_to_mBar(((610.78 * np.exp(temperature / (temperature + 238.3) * 17.2694)) / 1000) * (1 - humidity/100))
+                        vpd = np.where(vpd == vpd, vpd, vpd_calc)
+
+                        # Sensors without an altitude reading (or stuck at
+                        # 0) fall back to the configured altitude
+                        altitude = np.where((altitude != altitude) | (altitude == 0),
+                                            MY_ALTITUDE,
+                                            altitude)
+
+                    # 'observed' is second-resolution RFC3339 in UTC - one
+                    # vectorized parse replaces a datetime.fromisoformat
+                    # call (and a datetime object) per sample
+                    ts_ns = np.array(
+                        [sample['observed'][:19] for sample in items],
+                        dtype='datetime64[s]').astype(np.int64) * 1_000_000_000
+
+                    # One bulk .tolist() per array hands the loop plain
+                    # Python floats/ints - no per-row float() re-wrapping
+                    # and no NumPy scalars reaching the field formatter
+                    humidity = humidity.tolist()
+                    temperature = temperature.tolist()
+                    pressure = pressure.tolist()
+                    abs_humidity = abs_humidity.tolist()
+                    altitude = altitude.tolist()
+                    distance = distance.tolist()
+                    dewpoint = dewpoint.tolist()
+                    vpd = vpd.tolist()
+                    has_pressure = has_pressure.tolist()
+                    ts_ns = ts_ns.tolist()
+
+                    for i, sample in enumerate(items):
+                        # NaN != NaN - a field is only written if it was
+                        # either reported by the API or derivable
+                        fields = {}
+                        if humidity[i] == humidity[i]:
+                            fields['humidity'] = humidity[i]
+                        if temperature[i] == temperature[i]:
+                            fields['temperature'] = temperature[i]
+                        if has_pressure[i]:
+                            fields['pressure'] = pressure[i]
+                        if abs_humidity[i] == abs_humidity[i]:
+                            fields['abs_humidity'] = abs_humidity[i]
+                        fields['altitude'] = altitude[i]
+                        if distance[i] == distance[i]:
+                            fields['distance'] = distance[i]
+                        if dewpoint[i] == dewpoint[i]:
+                            fields['dewpoint'] = dewpoint[i]
+                        if vpd[i] == vpd[i]:
+                            fields['vpd'] = vpd[i]
+
+                        emit_line(measurement_lines, tag_prefix, fields,
+                                  ts_ns[i])
+
+                # Buffer each slice exactly once - a slice retried after
+                # a failed flush below must resend the same lines, not
+                # append a second copy of them
+                if not slice_buffered:
+                    pending_lines.extend(measurement_lines)
+                    pending_count += numsamples
+                    slice_buffered = True
+
+                if pending_count >= BATCH_SIZE:
+                    write_to_victoriametrics(pending_lines)
+                    pending_lines = []
+                    pending_count = 0
+
+                iteration += 1
+
+            except Exception as e:
+                retrycount += 1
+                print('')
+                print('##################Something went wrong################')
+                print('~~~~~~~~~~~~Exception~~~~~~~~~~~~~')
+                pprint(e)
+                print('~~~~~~~~~~~~Request status code~~~~~~~~~~~~~')
+                pprint(r.status_code)
+                print('~~~~~~~~~~~~~~~~~~~~~~~~~')
+                pprint(r.headers)
+                print('~~~~~~~~~~~~Request content~~~~~~~~~~~~~')
+                pprint(r.content.decode('utf-8'))
+                print('------------------------------------------------------')
+                print(f'Retrying iteration {iteration}/{iterations}')
+                print(f'Try {retrycount}/{MAXRETRY}')
+                print(f'sleeping for {RETRYWAIT} seconds before next try')
+                print('######################################################')
+                print('')
+                if retrycount >= MAXRETRY:
+                    print(f'Reached max retries ({MAXRETRY}) Stopping now!')
+                    sys.exit()
+                time.sleep(RETRYWAIT)
+                # Fetch the failed slice again (an already queued prefetch
+                # of the next slice simply gets re-queued once this one
+                # goes through)
+                future = prefetch.submit(fetch_slice, item)
+                continue
+            else:
+                failed = False
+finally:
+    # Flush whatever is still buffered - also on the way out of an
+    # exception or a Ctrl-C, so already fetched samples are not lost
+    write_to_victoriametrics(pending_lines)